@@ -0,0 +1,33 @@
+"""
+One-time backfill of the daily_rollups documents the weekly report reads
+
+Run after deploying the functions that maintain the rollups; every day from
+--days ago up to yesterday is recomputed from the raw documents.
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+from firebase_admin import initialize_app, firestore
+from services.report_service import ReportService
+
+
+def backfill_rollups(days):
+    today = datetime.now(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    start_date = today - timedelta(days=days)
+
+    print(f"Rebuilding daily rollups from {start_date.date()} to {today.date()}...")
+    ReportService(firestore.client()).rebuild_rollups(start_date, today)
+    print("✅ Rollup backfill complete!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--days", type=int, default=14, help="Number of past days to rebuild"
+    )
+    args = parser.parse_args()
+
+    initialize_app()
+    backfill_rollups(args.days)
@@ -2,12 +2,21 @@
 Main entry point for Firebase Cloud Functions
 """
 
-import json
 import logging
-from datetime import datetime, timezone
-from firebase_functions import https_fn, scheduler_fn, options
-from firebase_admin import initialize_app, firestore
-from services.credit_service import CreditService
+import google.cloud.logging
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict
+from firebase_functions import https_fn, scheduler_fn, tasks_fn, options
+from firebase_admin import initialize_app, firestore, functions
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from services.credit_service import (
+    CreditService,
+    DeductionStatus,
+    InsufficientCredits,
+)
 from services.generation_service import GenerationService
 from services.report_service import ReportService
 from validators.request_validator import RequestValidator
@@ -17,23 +26,75 @@ from models.transaction import TransactionType
 # Initialize Firebase Admin
 initialize_app()
 
-# Initialize services
-db = firestore.client()
-credit_service = CreditService(db)
-generation_service = GenerationService(db)
-report_service = ReportService(db)
+# Services are built on first use and then reused by the warm instance, so
+# cold starts don't pay for clients a given function never touches
 validator = RequestValidator()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+
+@lru_cache(maxsize=1)
+def _db() -> firestore.Client:
+    return firestore.client()
+
+
+@lru_cache(maxsize=1)
+def _credit() -> CreditService:
+    return CreditService(_db())
+
+
+@lru_cache(maxsize=1)
+def _generation() -> GenerationService:
+    return GenerationService(_db())
+
+
+@lru_cache(maxsize=1)
+def _report() -> ReportService:
+    return ReportService(_db())
+
+
+# Configure logging once per instance: route records to Cloud Logging as
+# structured entries, falling back to stderr when no client can be created
+# (e.g. local emulator without credentials)
+try:
+    google.cloud.logging.Client().setup_logging(log_level=logging.INFO)
+except Exception:
+    logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _json_response(body: dict, status: int) -> https_fn.Response:
+    """Serialize a response body with orjson"""
+    return https_fn.Response(
+        orjson.dumps(body),
+        status=status,
+        headers={"Content-Type": "application/json"},
+    )
+
+
+def _format_legacy_timestamp(value: Any) -> str:
+    """Format a timestamp that may not be a datetime"""
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _format_transaction(
+    t: Dict[str, Any], format_timestamp: Callable[[Any], str] = datetime.isoformat
+) -> Dict[str, Any]:
+    """Shape a transaction record for the getUserCredits response"""
+    return {
+        "id": t["transactionId"],
+        "type": t["type"],
+        "credits": t["credits"],
+        "generationRequestId": t.get("generationRequestId", ""),
+        "timestamp": format_timestamp(t["timestamp"]),
+    }
+
+
 @https_fn.on_request(
+    # Keep one instance warm so generation requests skip the cold start
+    min_instances=1,
     cors=options.CorsOptions(
         cors_origins="*",
         cors_methods=["POST"],
-    )
+    ),
 )
 def createGenerationRequest(req: https_fn.Request) -> https_fn.Response:
     """
@@ -52,28 +113,20 @@ def createGenerationRequest(req: https_fn.Request) -> https_fn.Response:
     try:
         # Parse request body
         if req.method != "POST":
-            return https_fn.Response(
-                json.dumps({"error": "Method not allowed"}),
-                status=405,
-                headers={"Content-Type": "application/json"},
-            )
+            return _json_response({"error": "Method not allowed"}, 405)
 
-        data = req.get_json()
-        if not data:
-            return https_fn.Response(
-                json.dumps({"error": "Invalid request body"}),
-                status=400,
-                headers={"Content-Type": "application/json"},
-            )
+        # Decode the raw body in one pass; malformed JSON is a client error
+        try:
+            data = orjson.loads(req.get_data())
+        except orjson.JSONDecodeError:
+            return _json_response({"error": "Invalid request body"}, 400)
+        if not data or not isinstance(data, dict):
+            return _json_response({"error": "Invalid request body"}, 400)
 
         # Validate request
         validation_result = validator.validate_generation_request(data)
-        if not validation_result["valid"]:
-            return https_fn.Response(
-                json.dumps({"error": validation_result["error"]}),
-                status=400,
-                headers={"Content-Type": "application/json"},
-            )
+        if not validation_result.valid:
+            return _json_response({"error": validation_result.error}, 400)
 
         # Extract validated data
         user_id = data["userId"]
@@ -83,23 +136,8 @@ def createGenerationRequest(req: https_fn.Request) -> https_fn.Response:
         size = data["size"]
         prompt = data["prompt"]
 
-        # Calculate credit cost
-        credit_cost = validator.get_credit_cost(size)
-
-        # Check user credits
-        user_credits = credit_service.get_user_credits(user_id)
-        if user_credits < credit_cost:
-            return https_fn.Response(
-                json.dumps(
-                    {
-                        "error": "Insufficient credits",
-                        "required": credit_cost,
-                        "available": user_credits,
-                    }
-                ),
-                status=402,
-                headers={"Content-Type": "application/json"},
-            )
+        # Calculate credit cost (size was validated above)
+        credit_cost = validator.CREDIT_COSTS[size]
 
         # Create generation request
         generation_request = GenerationRequest(
@@ -113,92 +151,126 @@ def createGenerationRequest(req: https_fn.Request) -> https_fn.Response:
         )
 
         # Save request to database
-        request_ref = db.collection("generation_requests").document()
+        request_ref = _db().collection("generation_requests").document()
         generation_request.request_id = request_ref.id
 
-        # Start transaction for atomic credit deduction
+        # Transactional fallback for when the balance changes concurrently
         @firestore.transactional
         def create_request_transaction(transaction):
-            # Deduct credits
-            success = credit_service.deduct_credits(
+            # Deduct credits (the transactional read is the only balance check)
+            status, current_credits = _credit().deduct_credits(
                 transaction, user_id, credit_cost, request_ref.id
             )
-            if not success:
+            if status in (DeductionStatus.INSUFFICIENT, DeductionStatus.MISSING):
+                raise InsufficientCredits(max(current_credits, 0), credit_cost)
+            if status != DeductionStatus.OK:
                 raise Exception("Failed to deduct credits")
 
             # Save generation request
             transaction.set(request_ref, generation_request.to_dict())
+            _report().build_request_rollup(transaction, generation_request)
 
-            return True
-
-        # Execute transaction
-        transaction = db.transaction()
-        create_request_transaction(transaction)
+        try:
+            # Optimistic path: one balance read and a single batched commit,
+            # guarded by the user document's update time. Nothing is written
+            # unless the balance read covers the cost.
+            current_credits, last_update_time = _credit().get_balance_snapshot(user_id)
+            if current_credits < credit_cost:
+                raise InsufficientCredits(max(current_credits, 0), credit_cost)
+
+            batch = _db().batch()
+            batch.set(request_ref, generation_request.to_dict())
+            _credit().build_deduction_batch(
+                batch, user_id, credit_cost, request_ref.id, last_update_time
+            )
+            _report().build_request_rollup(batch, generation_request)
+            try:
+                batch.commit()
+            except (FailedPrecondition, NotFound):
+                # User document changed (or vanished) since the read; retry
+                # transactionally so concurrent requests can't overdraw it
+                logger.info("Credit contention for user %s, retrying", user_id)
+                create_request_transaction(_db().transaction())
+        except InsufficientCredits as e:
+            return _json_response(
+                {
+                    "error": "Insufficient credits",
+                    "required": e.required_credits,
+                    "available": e.current_credits,
+                },
+                402,
+            )
 
         # Simulate AI generation
         try:
-            image_url = generation_service.generate_image(
+            image_url = _generation().generate_image(
                 generation_request.request_id, model, style, color, size, prompt
             )
 
             # Update request with success
-            request_ref.update(
+            batch = _db().batch()
+            batch.update(
+                request_ref,
                 {
                     "status": "completed",
                     "imageUrl": image_url,
-                    "completedAt": datetime.now(timezone.utc),
-                }
+                    "completedAt": firestore.SERVER_TIMESTAMP,
+                },
             )
+            _report().build_outcome_rollup(batch, generation_request, completed=True)
+            batch.commit()
 
             # Return success response
-            return https_fn.Response(
-                json.dumps(
-                    {
-                        "generationRequestId": generation_request.request_id,
-                        "deductedCredits": credit_cost,
-                        "imageUrl": image_url,
-                    }
-                ),
-                status=200,
-                headers={"Content-Type": "application/json"},
+            return _json_response(
+                {
+                    "generationRequestId": generation_request.request_id,
+                    "deductedCredits": credit_cost,
+                    "imageUrl": image_url,
+                },
+                200,
             )
 
         except Exception as e:
-            logger.error(f"Generation failed: {str(e)}")
+            logger.error(
+                "Generation failed: %s",
+                e,
+                extra={
+                    "json_fields": {
+                        "requestId": request_ref.id,
+                        "userId": user_id,
+                        "model": model,
+                    }
+                },
+            )
 
-            # Update request with failure
-            request_ref.update(
+            # Mark the request failed and refund credits in a single commit
+            batch = _db().batch()
+            batch.update(
+                request_ref,
                 {
                     "status": "failed",
                     "error": str(e),
-                    "completedAt": datetime.now(timezone.utc),
-                }
+                    "completedAt": firestore.SERVER_TIMESTAMP,
+                },
             )
-
-            # Refund credits
-            credit_service.refund_credits(
-                user_id, credit_cost, generation_request.request_id
+            _credit().build_refund_batch(
+                batch, user_id, credit_cost, generation_request.request_id
             )
+            _report().build_outcome_rollup(batch, generation_request, completed=False)
+            batch.commit()
 
-            return https_fn.Response(
-                json.dumps(
-                    {
-                        "error": "Image generation failed",
-                        "details": str(e),
-                        "creditsRefunded": credit_cost,
-                    }
-                ),
-                status=500,
-                headers={"Content-Type": "application/json"},
+            return _json_response(
+                {
+                    "error": "Image generation failed",
+                    "details": str(e),
+                    "creditsRefunded": credit_cost,
+                },
+                500,
             )
 
     except Exception as e:
-        logger.error(f"Error in createGenerationRequest: {str(e)}")
-        return https_fn.Response(
-            json.dumps({"error": "Internal server error"}),
-            status=500,
-            headers={"Content-Type": "application/json"},
-        )
+        logger.error("Error in createGenerationRequest: %s", e)
+        return _json_response({"error": "Internal server error"}, 500)
 
 
 @https_fn.on_request(
@@ -213,84 +285,116 @@ def getUserCredits(req: https_fn.Request) -> https_fn.Response:
 
     Query parameters:
     - userId: str (required)
+    - cursor: str (optional, nextCursor of the previous page)
     """
     try:
         # Validate method
         if req.method != "GET":
-            return https_fn.Response(
-                json.dumps({"error": "Method not allowed"}),
-                status=405,
-                headers={"Content-Type": "application/json"},
-            )
+            return _json_response({"error": "Method not allowed"}, 405)
 
         # Get userId from query parameters
         user_id = req.args.get("userId")
         if not user_id:
-            return https_fn.Response(
-                json.dumps({"error": "userId parameter is required"}),
-                status=400,
-                headers={"Content-Type": "application/json"},
-            )
+            return _json_response({"error": "userId parameter is required"}, 400)
 
-        # Get current credits
-        current_credits = credit_service.get_user_credits(user_id)
+        # The cursor only encodes the previous page's last transaction; the
+        # query is scoped to userId, so a foreign cursor can't leak history
+        cursor = req.args.get("cursor")
+        try:
+            start_after = CreditService.decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return _json_response({"error": "Invalid cursor"}, 400)
+
+        # The balance read and the history query are independent, so fetch
+        # the history page while the balance is read
+        page_size = 50
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            transactions_future = executor.submit(
+                _credit().get_transaction_history,
+                user_id,
+                limit=page_size,
+                start_after=start_after,
+            )
+            current_credits = _credit().get_user_credits(user_id)
+            transactions = transactions_future.result()
 
-        # Get transaction history
-        transactions = credit_service.get_transaction_history(user_id)
+        # Firestore returns datetimes, so format without a per-record check
+        try:
+            history = [_format_transaction(t) for t in transactions]
+        except TypeError:
+            logger.warning("Non-datetime transaction timestamp for user %s", user_id)
+            history = [
+                _format_transaction(t, _format_legacy_timestamp) for t in transactions
+            ]
+
+        # Clients pass this back as `cursor` to fetch the next page
+        next_cursor = None
+        if len(transactions) == page_size:
+            try:
+                next_cursor = CreditService.encode_cursor(transactions[-1])
+            except TypeError:
+                logger.warning("Cannot page past legacy timestamp for %s", user_id)
 
         # Format response
         response = {
             "currentCredits": current_credits,
-            "transactions": [
-                {
-                    "id": t["transactionId"],
-                    "type": t["type"],
-                    "credits": t["credits"],
-                    "generationRequestId": t.get("generationRequestId", ""),
-                    "timestamp": t["timestamp"].isoformat()
-                    if hasattr(t["timestamp"], "isoformat")
-                    else str(t["timestamp"]),
-                }
-                for t in transactions
-            ],
+            "transactions": history,
+            "nextCursor": next_cursor,
         }
 
-        return https_fn.Response(
-            json.dumps(response),
-            status=200,
-            headers={"Content-Type": "application/json"},
-        )
+        return _json_response(response, 200)
 
     except Exception as e:
-        logger.error(f"Error in getUserCredits: {str(e)}")
-        return https_fn.Response(
-            json.dumps({"error": "Internal server error"}),
-            status=500,
-            headers={"Content-Type": "application/json"},
-        )
+        logger.error("Error in getUserCredits: %s", e)
+        return _json_response({"error": "Internal server error"}, 500)
 
 
 @scheduler_fn.on_schedule(
     schedule="0 0 * * 1",  # Every Monday at 00:00 UTC
     timezone=scheduler_fn.Timezone("UTC"),
-    memory=options.MemoryOption.MB_512,
 )
 def scheduleWeeklyReport(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Enqueue weekly usage report generation
+    Runs every Monday at 00:00 UTC; the report is built by runWeeklyReport
+    """
+    try:
+        logger.info("Enqueueing weekly report generation")
+
+        # Hand the heavy work to the task queue so it gets its own
+        # memory/timeout budget and Cloud Tasks retries
+        task_id = functions.task_queue("runWeeklyReport").enqueue({})
+
+        logger.info("Weekly report task enqueued: %s", task_id)
+
+        # Return success (for monitoring)
+        return {"reportStatus": "queued"}
+
+    except Exception as e:
+        logger.error("Error enqueueing weekly report: %s", e)
+        raise e
+
+
+@tasks_fn.on_task_dispatched(
+    retry_config=options.RetryConfig(max_attempts=3, min_backoff_seconds=60),
+    rate_limits=options.RateLimits(max_concurrent_dispatches=1),
+    memory=options.MemoryOption.GB_2,
+    timeout_sec=540,
+)
+def runWeeklyReport(req: tasks_fn.CallableRequest) -> None:
     """
     Generate weekly usage report
-    Runs every Monday at 00:00 UTC
+    Dispatched by the task queue that scheduleWeeklyReport fills
     """
     try:
         logger.info("Starting weekly report generation")
 
         # Generate report
-        report_id = report_service.generate_weekly_report()
-
-        logger.info(f"Weekly report generated successfully: {report_id}")
+        report_id = _report().generate_weekly_report()
 
-        # Return success (for monitoring)
-        return {"reportStatus": "success"}
+        logger.info("Weekly report generated successfully: %s", report_id)
 
     except Exception as e:
-        logger.error(f"Error generating weekly report: {str(e)}")
+        # Re-raise so Cloud Tasks retries the dispatch
+        logger.error("Error generating weekly report: %s", e)
         raise e
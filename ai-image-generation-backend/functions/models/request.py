@@ -2,6 +2,7 @@
 models/request.py - Generation Request model
 """
 
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Optional
 from enum import Enum
@@ -14,62 +15,55 @@ class RequestStatus(str, Enum):
     FAILED = "failed"
 
 
+@dataclass(slots=True)
 class GenerationRequest:
     """Generation request model"""
     
-    def __init__(
-        self,
-        user_id: str,
-        model: str,
-        style: str,
-        color: str,
-        size: str,
-        prompt: str,
-        credits_charged: int,
-        request_id: Optional[str] = None,
-        status: RequestStatus = RequestStatus.PENDING,
-        image_url: Optional[str] = None,
-        error: Optional[str] = None,
-        created_at: Optional[datetime] = None,
-        completed_at: Optional[datetime] = None
-    ):
-        self.request_id = request_id
-        self.user_id = user_id
-        self.model = model
-        self.style = style
-        self.color = color
-        self.size = size
-        self.prompt = prompt
-        self.status = status
-        self.image_url = image_url
-        self.error = error
-        self.credits_charged = credits_charged
-        self.created_at = created_at or datetime.now(timezone.utc)
-        self.completed_at = completed_at
+    # (attribute, Firestore key) pairs that are always written
+    _FIELD_MAP = (
+        ("user_id", "userId"),
+        ("model", "model"),
+        ("style", "style"),
+        ("color", "color"),
+        ("size", "size"),
+        ("prompt", "prompt"),
+        ("status", "status"),
+        ("credits_charged", "creditsCharged"),
+        ("created_at", "createdAt"),
+    )
+    # (attribute, Firestore key) pairs that are only written when set
+    _OPTIONAL_FIELD_MAP = (
+        ("request_id", "requestId"),
+        ("image_url", "imageUrl"),
+        ("error", "error"),
+        ("completed_at", "completedAt"),
+    )
+    
+    user_id: str
+    model: str
+    style: str
+    color: str
+    size: str
+    prompt: str
+    credits_charged: int
+    request_id: Optional[str] = None
+    status: RequestStatus = RequestStatus.PENDING
+    image_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    
+    def __post_init__(self):
+        self.created_at = self.created_at or datetime.now(timezone.utc)
     
     def to_dict(self):
         """Convert to dictionary for Firestore"""
-        data = {
-            "userId": self.user_id,
-            "model": self.model,
-            "style": self.style,
-            "color": self.color,
-            "size": self.size,
-            "prompt": self.prompt,
-            "status": self.status,
-            "creditsCharged": self.credits_charged,
-            "createdAt": self.created_at
-        }
-        
-        if self.request_id:
-            data["requestId"] = self.request_id
-        if self.image_url:
-            data["imageUrl"] = self.image_url
-        if self.error:
-            data["error"] = self.error
-        if self.completed_at:
-            data["completedAt"] = self.completed_at
-            
+        data = {key: getattr(self, attr) for attr, key in self._FIELD_MAP}
+        data.update(
+            (key, value)
+            for attr, key in self._OPTIONAL_FIELD_MAP
+            if (value := getattr(self, attr))
+        )
         return data
     
     @classmethod
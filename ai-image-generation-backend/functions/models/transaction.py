@@ -2,9 +2,11 @@
 models/transaction.py - Credit Transaction model
 """
 
-from datetime import datetime, timezone
+from dataclasses import dataclass
+from datetime import datetime
 from typing import Optional
 from enum import Enum
+from firebase_admin.firestore import SERVER_TIMESTAMP
 
 
 class TransactionType(str, Enum):
@@ -14,42 +16,44 @@ class TransactionType(str, Enum):
     CREDIT = "credit"  # For initial credits or manual additions
 
 
+@dataclass(slots=True)
 class CreditTransaction:
     """Credit transaction model"""
     
-    def __init__(
-        self,
-        user_id: str,
-        type: TransactionType,
-        credits: int,
-        reason: str,
-        transaction_id: Optional[str] = None,
-        generation_request_id: Optional[str] = None,
-        timestamp: Optional[datetime] = None
-    ):
-        self.transaction_id = transaction_id
-        self.user_id = user_id
-        self.type = type
-        self.credits = credits
-        self.reason = reason
-        self.generation_request_id = generation_request_id
-        self.timestamp = timestamp or datetime.now(timezone.utc)
+    # (attribute, Firestore key) pairs that are always written
+    _FIELD_MAP = (
+        ("user_id", "userId"),
+        ("type", "type"),
+        ("credits", "credits"),
+        ("reason", "reason"),
+        ("timestamp", "timestamp"),
+    )
+    # (attribute, Firestore key) pairs that are only written when set
+    _OPTIONAL_FIELD_MAP = (
+        ("transaction_id", "transactionId"),
+        ("generation_request_id", "generationRequestId"),
+    )
+    
+    user_id: str
+    type: TransactionType
+    credits: int
+    reason: str
+    transaction_id: Optional[str] = None
+    generation_request_id: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    
+    def __post_init__(self):
+        # Resolved by Firestore at commit time to avoid client clock skew
+        self.timestamp = self.timestamp or SERVER_TIMESTAMP
     
     def to_dict(self):
         """Convert to dictionary for Firestore"""
-        data = {
-            "userId": self.user_id,
-            "type": self.type,
-            "credits": self.credits,
-            "reason": self.reason,
-            "timestamp": self.timestamp
-        }
-        
-        if self.transaction_id:
-            data["transactionId"] = self.transaction_id
-        if self.generation_request_id:
-            data["generationRequestId"] = self.generation_request_id
-            
+        data = {key: getattr(self, attr) for attr, key in self._FIELD_MAP}
+        data.update(
+            (key, value)
+            for attr, key in self._OPTIONAL_FIELD_MAP
+            if (value := getattr(self, attr))
+        )
         return data
     
     @classmethod
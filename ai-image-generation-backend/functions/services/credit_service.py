@@ -3,21 +3,78 @@ Credit Service - Handles all credit-related operations
 """
 
 import logging
-from datetime import datetime, timezone
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Optional, List, Dict, Any, Tuple
 from firebase_admin import firestore
 from models.transaction import CreditTransaction, TransactionType
 
 logger = logging.getLogger(__name__)
 
+# Immutable write sentinels, resolved once at import
+SERVER_TS = firestore.SERVER_TIMESTAMP
+
+# History cursors encode timestamps as microseconds since this instant
+_CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class DeductionStatus(str, Enum):
+    """Outcome of a credit deduction attempt"""
+
+    OK = "ok"
+    INSUFFICIENT = "insufficient"
+    MISSING = "missing"
+    ERROR = "error"
+
+
+class InsufficientCredits(Exception):
+    """Raised when a user's balance cannot cover a generation request"""
+
+    def __init__(self, current_credits: int, required_credits: int):
+        super().__init__(
+            f"Insufficient credits: {current_credits} available, "
+            f"{required_credits} required"
+        )
+        self.current_credits = current_credits
+        self.required_credits = required_credits
+
 
 class CreditService:
     """Service for managing user credits and transactions"""
 
+    # Fields returned by get_transaction_history (the document ID is added)
+    HISTORY_FIELDS = ["type", "credits", "generationRequestId", "timestamp"]
+
+    # Balance cache for warm instances; keep the TTL short to bound staleness
+    CREDIT_CACHE_TTL_SECONDS = 2
+    CREDIT_CACHE_MAX_SIZE = 10_000
+
     def __init__(self, db: firestore.Client):
         self.db = db
         self.users_collection = db.collection("users")
         self.transactions_collection = db.collection("credit_transactions")
+        # user_id -> (expiry on the monotonic clock, credits); request
+        # threads share the service, so every access holds the lock
+        self._credit_cache: Dict[str, Tuple[float, int]] = {}
+        self._credit_cache_lock = threading.Lock()
+
+    def _cache_credits(self, user_id: str, credits: int) -> None:
+        """Cache a user's balance, evicting the oldest entry when full"""
+        entry = (time.monotonic() + self.CREDIT_CACHE_TTL_SECONDS, credits)
+        with self._credit_cache_lock:
+            self._credit_cache.pop(user_id, None)
+            if len(self._credit_cache) >= self.CREDIT_CACHE_MAX_SIZE:
+                # Dicts keep insertion order, so the first key is the oldest
+                self._credit_cache.pop(next(iter(self._credit_cache)))
+            self._credit_cache[user_id] = entry
+
+    def _invalidate_credits(self, user_id: str) -> None:
+        """Drop a user's cached balance after a credit mutation"""
+        with self._credit_cache_lock:
+            self._credit_cache.pop(user_id, None)
 
     def get_user_credits(self, user_id: str) -> int:
         """
@@ -29,25 +86,100 @@ class CreditService:
         Returns:
             Current credit balance (0 if user doesn't exist)
         """
+        with self._credit_cache_lock:
+            cached = self._credit_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
         try:
             user_doc = self.users_collection.document(user_id).get()
-            if user_doc.exists:
-                return user_doc.to_dict().get("credits", 0)
-            return 0
+            credits = user_doc.to_dict().get("credits", 0) if user_doc.exists else 0
+            self._cache_credits(user_id, credits)
+            return credits
         except Exception as e:
-            logger.error(f"Error getting user credits: {str(e)}")
+            logger.error("Error getting user credits: %s", e)
             return 0
 
+    def get_balance_snapshot(self, user_id: str) -> Tuple[int, Optional[datetime]]:
+        """
+        Read a user's credit balance together with the document update time
+
+        Args:
+            user_id: The user's ID
+
+        Returns:
+            Tuple of (credit balance, update time); (0, None) if the user
+            doesn't exist
+        """
+        user_doc = self.users_collection.document(user_id).get()
+        if not user_doc.exists:
+            return 0, None
+        return user_doc.to_dict().get("credits", 0), user_doc.update_time
+
+    def build_deduction_batch(
+        self,
+        batch: firestore.WriteBatch,
+        user_id: str,
+        amount: int,
+        generation_request_id: str,
+        last_update_time: Optional[datetime] = None,
+    ) -> None:
+        """
+        Stage a credit deduction on a write batch without reading the balance
+
+        Args:
+            batch: Firestore write batch to stage the writes on
+            user_id: The user's ID
+            amount: Amount of credits to deduct
+            generation_request_id: ID of the generation request
+            last_update_time: Update time of the user document the balance
+                was checked against; the commit fails if it changed since
+        """
+        self._invalidate_credits(user_id)
+        user_ref = self.users_collection.document(user_id)
+        option = (
+            self.db.write_option(last_update_time=last_update_time)
+            if last_update_time
+            else None
+        )
+        batch.update(
+            user_ref,
+            {
+                "credits": firestore.Increment(-amount),
+                "updatedAt": SERVER_TS,
+            },
+            option=option,
+        )
+
+        # Create transaction record
+        credit_transaction = CreditTransaction(
+            user_id=user_id,
+            type=TransactionType.DEDUCTION,
+            credits=amount,
+            generation_request_id=generation_request_id,
+            reason=f"Image generation - {amount} credits",
+        )
+
+        transaction_ref = self.transactions_collection.document()
+        credit_transaction.transaction_id = transaction_ref.id
+        batch.set(transaction_ref, credit_transaction.to_dict())
+
     def deduct_credits(
         self,
         transaction: firestore.Transaction,
         user_id: str,
         amount: int,
         generation_request_id: str,
-    ) -> bool:
+    ) -> Tuple[DeductionStatus, int]:
         """
         Deduct credits from user account atomically
 
+        Transactional fallback for createGenerationRequest: the balance is
+        normally checked with get_balance_snapshot and deducted with a batch
+        guarded by the snapshot's update time (build_deduction_batch). When
+        that precondition fails because the balance changed concurrently,
+        this re-checks the balance inside the transaction instead.
+
         Args:
             transaction: Firestore transaction object
             user_id: The user's ID
@@ -55,7 +187,7 @@ class CreditService:
             generation_request_id: ID of the generation request
 
         Returns:
-            True if successful, False otherwise
+            Tuple of (status, current credit balance before deduction)
         """
         try:
             # Get user document reference
@@ -69,20 +201,23 @@ class CreditService:
             )
 
             if not user_doc.exists:
-                logger.error(f"User {user_id} not found")
-                return False
+                logger.error("User %s not found", user_id)
+                return DeductionStatus.MISSING, 0
 
             current_credits = user_doc.to_dict().get("credits", 0)
 
             if current_credits < amount:
-                logger.error(f"Insufficient credits for user {user_id}")
-                return False
+                logger.error("Insufficient credits for user %s", user_id)
+                return DeductionStatus.INSUFFICIENT, current_credits
 
-            # Update user credits
-            new_credits = current_credits - amount
+            # Update user credits with a server-side increment
+            self._invalidate_credits(user_id)
             transaction.update(
                 user_ref,
-                {"credits": new_credits, "updatedAt": datetime.now(timezone.utc)},
+                {
+                    "credits": firestore.Increment(-amount),
+                    "updatedAt": SERVER_TS,
+                },
             )
 
             # Create transaction record
@@ -98,12 +233,55 @@ class CreditService:
             credit_transaction.transaction_id = transaction_ref.id
             transaction.set(transaction_ref, credit_transaction.to_dict())
 
-            logger.info(f"Deducted {amount} credits from user {user_id}")
-            return True
+            logger.info("Deducted %s credits from user %s", amount, user_id)
+            return DeductionStatus.OK, current_credits
 
         except Exception as e:
-            logger.error(f"Error deducting credits: {str(e)}")
-            return False
+            logger.error("Error deducting credits: %s", e)
+            return DeductionStatus.ERROR, 0
+
+    def build_refund_batch(
+        self,
+        batch: firestore.WriteBatch,
+        user_id: str,
+        amount: int,
+        generation_request_id: str,
+    ) -> None:
+        """
+        Stage a credit refund on a write batch without reading the balance
+
+        Args:
+            batch: Firestore write batch to stage the writes on
+            user_id: The user's ID
+            amount: Amount of credits to refund
+            generation_request_id: ID of the failed generation request
+        """
+        self._invalidate_credits(user_id)
+
+        # Increment needs no prior read; merge creates a missing user
+        user_ref = self.users_collection.document(user_id)
+        batch.set(
+            user_ref,
+            {
+                "userId": user_id,
+                "credits": firestore.Increment(amount),
+                "updatedAt": SERVER_TS,
+            },
+            merge=True,
+        )
+
+        # Create refund transaction record
+        credit_transaction = CreditTransaction(
+            user_id=user_id,
+            type=TransactionType.REFUND,
+            credits=amount,
+            generation_request_id=generation_request_id,
+            reason=f"Refund for failed generation - {amount} credits",
+        )
+
+        transaction_ref = self.transactions_collection.document()
+        credit_transaction.transaction_id = transaction_ref.id
+        batch.set(transaction_ref, credit_transaction.to_dict())
 
     def refund_credits(
         self, user_id: str, amount: int, generation_request_id: str
@@ -120,70 +298,58 @@ class CreditService:
             True if successful, False otherwise
         """
         try:
-            # Use a transaction for atomic update
-            @firestore.transactional
-            def refund_transaction(transaction):
-                # Get user document
-                user_ref = self.users_collection.document(user_id)
-                user_doc_iter = transaction.get(user_ref)
-                # Handle both emulator (generator) and production (direct) formats
-                user_doc = (
-                    next(user_doc_iter)
-                    if hasattr(user_doc_iter, "__next__")
-                    else user_doc_iter
-                )
+            batch = self.db.batch()
+            self.build_refund_batch(batch, user_id, amount, generation_request_id)
+            batch.commit()
 
-                if not user_doc.exists:
-                    # Create user if doesn't exist (edge case)
-                    transaction.set(
-                        user_ref,
-                        {
-                            "userId": user_id,
-                            "credits": amount,
-                            "createdAt": datetime.now(timezone.utc),
-                            "updatedAt": datetime.now(timezone.utc),
-                        },
-                    )
-                else:
-                    # Update existing user credits
-                    current_credits = user_doc.to_dict().get("credits", 0)
-                    new_credits = current_credits + amount
-                    transaction.update(
-                        user_ref,
-                        {
-                            "credits": new_credits,
-                            "updatedAt": datetime.now(timezone.utc),
-                        },
-                    )
-
-                # Create refund transaction record
-                credit_transaction = CreditTransaction(
-                    user_id=user_id,
-                    type=TransactionType.REFUND,
-                    credits=amount,
-                    generation_request_id=generation_request_id,
-                    reason=f"Refund for failed generation - {amount} credits",
-                )
+            logger.info("Refunded %s credits to user %s", amount, user_id)
+            return True
 
-                transaction_ref = self.transactions_collection.document()
-                credit_transaction.transaction_id = transaction_ref.id
-                transaction.set(transaction_ref, credit_transaction.to_dict())
+        except Exception as e:
+            logger.error("Error refunding credits: %s", e)
+            return False
 
-                return True
+    @staticmethod
+    def encode_cursor(transaction: Dict[str, Any]) -> str:
+        """
+        Build the history cursor that resumes after a transaction
 
-            # Execute transaction
-            transaction = self.db.transaction()
-            refund_transaction(transaction)
+        Args:
+            transaction: Transaction returned by get_transaction_history
 
-            logger.info(f"Refunded {amount} credits to user {user_id}")
-            return True
+        Returns:
+            Cursor string of the form "<timestamp in microseconds>_<id>"
 
-        except Exception as e:
-            logger.error(f"Error refunding credits: {str(e)}")
-            return False
+        Raises:
+            TypeError: If the transaction timestamp isn't a datetime
+        """
+        micros = (transaction["timestamp"] - _CURSOR_EPOCH) // _MICROSECOND
+        return f"{micros}_{transaction['transactionId']}"
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+        """
+        Parse a history cursor built by encode_cursor
+
+        Args:
+            cursor: Cursor string
+
+        Returns:
+            Tuple of (timestamp, transaction ID)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        micros, _, transaction_id = cursor.partition("_")
+        if not micros.isdigit() or not transaction_id or "/" in transaction_id:
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+        return _CURSOR_EPOCH + int(micros) * _MICROSECOND, transaction_id
 
     def get_transaction_history(
-        self, user_id: str, limit: int = 50
+        self,
+        user_id: str,
+        limit: int = 50,
+        start_after: Optional[Tuple[datetime, str]] = None,
     ) -> List[Dict[str, Any]]:
         """
         Get credit transaction history for a user
@@ -191,20 +357,34 @@ class CreditService:
         Args:
             user_id: The user's ID
             limit: Maximum number of transactions to return
+            start_after: Decoded cursor (timestamp, transaction ID) of the
+                last transaction of the previous page
 
         Returns:
-            List of transaction dictionaries
+            List of transaction dictionaries holding HISTORY_FIELDS
         """
         try:
             # Query transactions for user, ordered by timestamp descending
+            # with the document ID breaking ties (served by the
+            # userId/timestamp composite index)
             query = (
                 self.transactions_collection.where("userId", "==", user_id)
                 .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                .order_by("__name__", direction=firestore.Query.DESCENDING)
                 .limit(limit)
             )
 
+            # Keyset pagination on field values: resume after the previous
+            # page's last transaction without reading it again
+            if start_after:
+                timestamp, transaction_id = start_after
+                query = query.start_after(
+                    {"timestamp": timestamp, "__name__": transaction_id}
+                )
+
+            # Only fetch the fields the history response uses
             transactions = []
-            for doc in query.stream():
+            for doc in query.select(self.HISTORY_FIELDS).stream():
                 transaction_data = doc.to_dict()
                 transaction_data["transactionId"] = doc.id
                 transactions.append(transaction_data)
@@ -212,7 +392,7 @@ class CreditService:
             return transactions
 
         except Exception as e:
-            logger.error(f"Error getting transaction history: {str(e)}")
+            logger.error("Error getting transaction history: %s", e)
             return []
 
     def create_user_with_credits(
@@ -233,14 +413,15 @@ class CreditService:
             user_data = {
                 "userId": user_id,
                 "credits": initial_credits,
-                "createdAt": datetime.now(timezone.utc),
-                "updatedAt": datetime.now(timezone.utc),
+                "createdAt": SERVER_TS,
+                "updatedAt": SERVER_TS,
             }
 
             if email:
                 user_data["email"] = email
 
             self.users_collection.document(user_id).set(user_data)
+            self._invalidate_credits(user_id)
 
             # Create initial credit transaction
             credit_transaction = CreditTransaction(
@@ -256,9 +437,9 @@ class CreditService:
                 credit_transaction.to_dict()
             )
 
-            logger.info(f"Created user {user_id} with {initial_credits} credits")
+            logger.info("Created user %s with %s credits", user_id, initial_credits)
             return True
 
         except Exception as e:
-            logger.error(f"Error creating user: {str(e)}")
+            logger.error("Error creating user: %s", e)
             return False
@@ -22,6 +22,24 @@ class GenerationService:
     MODEL_A_BASE_URL = "https://placeholder-model-a.com/image"
     MODEL_B_BASE_URL = "https://placeholder-model-b.com/image"
 
+    # Per-model lookup tables; unknown models fall back to Model B
+    _FAILURE_TABLE = {
+        "Model A": MODEL_A_FAILURE_RATE,
+        "Model B": MODEL_B_FAILURE_RATE,
+    }
+    MODEL_URLS = {
+        "Model A": MODEL_A_BASE_URL,
+        "Model B": MODEL_B_BASE_URL,
+    }
+
+    _ERRORS = (
+        "AI model temporarily unavailable",
+        "Generation timeout",
+        "Invalid prompt processing",
+        "Resource allocation failed",
+        "Model inference error",
+    )
+
     def __init__(self, db: firestore.Client):
         self.db = db
         self.requests_collection = db.collection("generation_requests")
@@ -58,42 +76,31 @@ class GenerationService:
             time.sleep(processing_time)
 
             # Determine failure rate based on model
-            failure_rate = (
-                self.MODEL_A_FAILURE_RATE
-                if model == "Model A"
-                else self.MODEL_B_FAILURE_RATE
-            )
+            failure_rate = self._FAILURE_TABLE.get(model, self.MODEL_B_FAILURE_RATE)
 
             # Simulate random failure
             if random.random() < failure_rate:
-                error_messages = [
-                    "AI model temporarily unavailable",
-                    "Generation timeout",
-                    "Invalid prompt processing",
-                    "Resource allocation failed",
-                    "Model inference error",
-                ]
-                error_msg = random.choice(error_messages)
-                logger.error(f"Simulated generation failure: {error_msg}")
+                error_msg = self._ERRORS[random.randrange(len(self._ERRORS))]
+                logger.error("Simulated generation failure: %s", error_msg)
                 raise Exception(error_msg)
 
-            # Generate unique image URL based on model
-            timestamp = int(time.time() * 1000)
-            unique_id = f"{request_id}_{timestamp}"
-
-            if model == "Model A":
-                image_url = f"{self.MODEL_A_BASE_URL}_{unique_id}.jpg"
-            else:  # Model B
-                image_url = f"{self.MODEL_B_BASE_URL}_{unique_id}.jpg"
+            # Firestore request IDs are already unique, so they key the URL
+            base_url = self.MODEL_URLS.get(model, self.MODEL_B_BASE_URL)
+            image_url = f"{base_url}_{request_id}.jpg"
 
             # Log successful generation
             logger.info(
-                f"Successfully generated image for request {request_id} "
-                f"using {model} with style={style}, color={color}, size={size}"
+                "Successfully generated image for request %s "
+                "using %s with style=%s, color=%s, size=%s",
+                request_id,
+                model,
+                style,
+                color,
+                size,
             )
 
             return image_url
 
         except Exception as e:
-            logger.error(f"Error in generate_image: {str(e)}")
+            logger.error("Error in generate_image: %s", e)
             raise
@@ -3,10 +3,14 @@ Report Service - Generates weekly usage and analytics reports
 """
 
 import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Union
 from firebase_admin import firestore
-from collections import defaultdict
+from collections import Counter, defaultdict
+from models.request import GenerationRequest
+from validators.request_validator import RequestValidator
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +18,67 @@ logger = logging.getLogger(__name__)
 class ReportService:
     """Service for generating weekly usage reports"""
 
+    # Fields the scan fallbacks read; other fields aren't transferred
+    # (createdAt is kept so page snapshots can serve as cursors)
+    REQUEST_SCAN_FIELDS = [
+        "createdAt",
+        "status",
+        "model",
+        "size",
+        "style",
+        "color",
+        "creditsCharged",
+    ]
+    # Values for fields a scanned request is missing, in column order
+    REQUEST_SCAN_DEFAULTS = {
+        "status": "pending",
+        "model": "Unknown",
+        "size": "Unknown",
+        "style": "Unknown",
+        "color": "Unknown",
+        "creditsCharged": 0,
+    }
+    TRANSACTION_SCAN_FIELDS = ["type", "credits"]
+    SCAN_PAGE_SIZE = 500
+
+    # Report metrics, split by how daily values combine into a week
+    TOTAL_FIELDS = (
+        "totalRequests",
+        "successfulRequests",
+        "failedRequests",
+        "totalCreditsConsumed",
+        "totalCreditsRefunded",
+    )
+    BREAKDOWN_FIELDS = (
+        "requestsByModel",
+        "requestsBySize",
+        "requestsByStyle",
+        "requestsByColor",
+        "creditsBySize",
+    )
+
+    # Request field -> configuration collection listing its valid values
+    CATALOG_COLLECTIONS = {"size": "sizes", "style": "styles", "color": "colors"}
+    # Aggregation queries run at once by the fallback path
+    AGGREGATION_WORKERS = 8
+    # Each day's rollup is split over this many documents, picked at random
+    # per write, to stay under Firestore's sustained write rate per document
+    ROLLUP_SHARDS = 10
+    # rollup_state document holding `since`, the first day the sharded
+    # rollups fully cover (unsharded rollups used "daily", now ignored)
+    ROLLUP_STATE_ID = "daily_sharded"
+
     def __init__(self, db: firestore.Client):
         self.db = db
         self.reports_collection = db.collection("weekly_reports")
         self.requests_collection = db.collection("generation_requests")
         self.transactions_collection = db.collection("credit_transactions")
+        # One document of running metric counters per UTC day (YYYY-MM-DD)
+        self.rollups_collection = db.collection("daily_rollups")
+        # ROLLUP_STATE_ID holds `since`, the first day the rollups fully cover
+        self.rollup_state_collection = db.collection("rollup_state")
+        # weekStartDate -> report data; saved reports never change
+        self._report_cache: Dict[datetime, Dict[str, Any]] = {}
 
     def generate_weekly_report(self) -> str:
         """
@@ -34,96 +94,55 @@ class ReportService:
             )
             start_date = end_date - timedelta(days=7)
 
-            logger.info(f"Generating report for {start_date} to {end_date}")
-
-            # Fetch generation requests for the week
-            requests_query = self.requests_collection.where(
-                "createdAt", ">=", start_date
-            ).where("createdAt", "<", end_date)
-
-            # Initialize counters
-            total_requests = 0
-            successful_requests = 0
-            failed_requests = 0
-            requests_by_model = defaultdict(int)
-            requests_by_size = defaultdict(int)
-            requests_by_style = defaultdict(int)
-            requests_by_color = defaultdict(int)
-            credits_by_size = defaultdict(int)
-
-            # Process each request
-            for doc in requests_query.stream():
-                request_data = doc.to_dict()
-                total_requests += 1
-
-                # Count by status
-                status = request_data.get("status", "pending")
-                if status == "completed":
-                    successful_requests += 1
-                elif status == "failed":
-                    failed_requests += 1
-
-                # Count by attributes
-                model = request_data.get("model", "Unknown")
-                size = request_data.get("size", "Unknown")
-                style = request_data.get("style", "Unknown")
-                color = request_data.get("color", "Unknown")
-                credits = request_data.get("creditsCharged", 0)
-
-                requests_by_model[model] += 1
-                requests_by_size[size] += 1
-                requests_by_style[style] += 1
-                requests_by_color[color] += 1
+            logger.info("Generating report for %s to %s", start_date, end_date)
 
-                if status == "completed":
-                    credits_by_size[size] += credits
-
-            # Fetch credit transactions for the week
-            transactions_query = self.transactions_collection.where(
-                "timestamp", ">=", start_date
-            ).where("timestamp", "<", end_date)
+            # The previous week's report doesn't depend on this week's data,
+            # so fetch it while the week's metrics are computed
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                previous_report_future = executor.submit(
+                    self._get_previous_report, start_date
+                )
 
-            total_credits_consumed = 0
-            total_credits_refunded = 0
+                # Prefer the daily rollups, then server-side aggregations;
+                # scan the week's documents when neither can be used
+                stats = self._read_rollups(start_date, end_date)
+                if stats is None:
+                    stats = self._aggregate_week(start_date, end_date)
+                if stats is None:
+                    # The two scans are independent, so stream them concurrently
+                    transactions_future = executor.submit(
+                        self._scan_transactions, start_date, end_date
+                    )
+                    stats = self._scan_requests(start_date, end_date)
+                    stats.update(transactions_future.result())
 
-            for doc in transactions_query.stream():
-                transaction_data = doc.to_dict()
-                transaction_type = transaction_data.get("type")
-                credits = transaction_data.get("credits", 0)
+                previous_report = previous_report_future.result()
 
-                if transaction_type == "deduction":
-                    total_credits_consumed += credits
-                elif transaction_type == "refund":
-                    total_credits_refunded += credits
+            total_requests = stats["totalRequests"]
 
             # Detect anomalies
             anomalies = self._detect_anomalies(
-                total_requests, failed_requests, requests_by_model, start_date
+                total_requests,
+                stats["failedRequests"],
+                stats["requestsByModel"],
+                previous_report,
             )
 
             # Calculate success rate
             success_rate = (
-                (successful_requests / total_requests * 100)
+                (stats["successfulRequests"] / total_requests * 100)
                 if total_requests > 0
                 else 0
             )
 
             # Create report document
             report_data = {
-                "weekStartDate": start_date.isoformat(),
-                "weekEndDate": end_date.isoformat(),
-                "totalRequests": total_requests,
-                "successfulRequests": successful_requests,
-                "failedRequests": failed_requests,
+                "weekStartDate": start_date,
+                "weekEndDate": end_date,
+                **stats,
                 "successRate": round(success_rate, 2),
-                "totalCreditsConsumed": total_credits_consumed,
-                "totalCreditsRefunded": total_credits_refunded,
-                "netCreditsUsed": total_credits_consumed - total_credits_refunded,
-                "requestsByModel": dict(requests_by_model),
-                "requestsBySize": dict(requests_by_size),
-                "requestsByStyle": dict(requests_by_style),
-                "requestsByColor": dict(requests_by_color),
-                "creditsBySize": dict(credits_by_size),
+                "netCreditsUsed": stats["totalCreditsConsumed"]
+                - stats["totalCreditsRefunded"],
                 "anomalies": anomalies,
                 "createdAt": datetime.now(timezone.utc),
             }
@@ -131,20 +150,465 @@ class ReportService:
             # Save report
             report_ref = self.reports_collection.document()
             report_ref.set(report_data)
+            self._report_cache[start_date] = report_data
 
-            logger.info(f"Weekly report generated successfully: {report_ref.id}")
+            logger.info("Weekly report generated successfully: %s", report_ref.id)
             return report_ref.id
 
         except Exception as e:
-            logger.error(f"Error generating weekly report: {str(e)}")
+            logger.error("Error generating weekly report: %s", e)
             raise
 
+    @staticmethod
+    def _rollup_id(day: datetime, shard: int) -> str:
+        """Rollup shard document ID of the UTC day containing the given time"""
+        return f"{day.astimezone(timezone.utc):%Y-%m-%d}_{shard}"
+
+    def _random_rollup_ref(self, day: datetime) -> firestore.DocumentReference:
+        """Reference to a random rollup shard of the given time's day"""
+        shard = random.randrange(self.ROLLUP_SHARDS)
+        return self.rollups_collection.document(self._rollup_id(day, shard))
+
+    @classmethod
+    def _merge_stats(cls, stats_list) -> Dict[str, Any]:
+        """Sum per-window metrics into one set of report metrics"""
+        totals = Counter()
+        breakdowns = defaultdict(Counter)
+        for stats in stats_list:
+            for key in cls.TOTAL_FIELDS:
+                totals[key] += stats.get(key, 0)
+            for key in cls.BREAKDOWN_FIELDS:
+                breakdowns[key].update(stats.get(key, {}))
+
+        return {
+            **{key: totals[key] for key in cls.TOTAL_FIELDS},
+            **{key: dict(breakdowns[key]) for key in cls.BREAKDOWN_FIELDS},
+        }
+
+    def build_request_rollup(
+        self,
+        batch: Union[firestore.WriteBatch, firestore.Transaction],
+        generation_request: GenerationRequest,
+    ) -> None:
+        """
+        Stage a new request's counters on its day's rollup
+
+        Args:
+            batch: Firestore write batch or transaction that creates the request
+            generation_request: The request being created
+        """
+        batch.set(
+            self._random_rollup_ref(generation_request.created_at),
+            {
+                "totalRequests": firestore.Increment(1),
+                "totalCreditsConsumed": firestore.Increment(
+                    generation_request.credits_charged
+                ),
+                "requestsByModel": {generation_request.model: firestore.Increment(1)},
+                "requestsBySize": {generation_request.size: firestore.Increment(1)},
+                "requestsByStyle": {generation_request.style: firestore.Increment(1)},
+                "requestsByColor": {generation_request.color: firestore.Increment(1)},
+            },
+            merge=True,
+        )
+
+    def build_outcome_rollup(
+        self,
+        batch: firestore.WriteBatch,
+        generation_request: GenerationRequest,
+        completed: bool,
+    ) -> None:
+        """
+        Stage a finished request's outcome on its day's rollup
+
+        Failed requests are refunded, so their credits count as refunded.
+
+        Args:
+            batch: Firestore write batch that records the outcome
+            generation_request: The finished request
+            completed: Whether generation succeeded
+        """
+        credits = firestore.Increment(generation_request.credits_charged)
+        if completed:
+            counters = {
+                "successfulRequests": firestore.Increment(1),
+                "creditsBySize": {generation_request.size: credits},
+            }
+        else:
+            counters = {
+                "failedRequests": firestore.Increment(1),
+                "totalCreditsRefunded": credits,
+            }
+
+        batch.set(
+            self._random_rollup_ref(generation_request.created_at),
+            counters,
+            merge=True,
+        )
+
+    def rebuild_rollups(self, start_date: datetime, end_date: datetime) -> None:
+        """
+        Recompute the daily rollups of past days from the raw documents
+
+        Marks start_date as the first covered day, so only run it once the
+        live rollup updates are deployed and end_date is no later than today.
+
+        Args:
+            start_date: First day to rebuild
+            end_date: Day after the last day to rebuild
+        """
+        day = start_date
+        while day < end_date:
+            next_day = day + timedelta(days=1)
+            stats = self._merge_stats(
+                [
+                    self._scan_requests_window(day, next_day),
+                    self._scan_transactions(day, next_day),
+                ]
+            )
+            # The whole day goes to shard 0; the other shards are cleared
+            batch = self.db.batch()
+            batch.set(self.rollups_collection.document(self._rollup_id(day, 0)), stats)
+            for shard in range(1, self.ROLLUP_SHARDS):
+                batch.delete(
+                    self.rollups_collection.document(self._rollup_id(day, shard))
+                )
+            batch.commit()
+            logger.info("Rebuilt rollup for %s", day.date())
+            day = next_day
+
+        self.rollup_state_collection.document(self.ROLLUP_STATE_ID).set(
+            {"since": start_date}
+        )
+
+    def _read_rollups(
+        self, start_date: datetime, end_date: datetime
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Sum the week's metrics from the daily rollup shard documents
+
+        Shards without a document had no writes.
+
+        Args:
+            start_date: Week start date
+            end_date: Week end date
+
+        Returns:
+            Report metrics, or None if the rollups don't cover the week
+        """
+        try:
+            state = self.rollup_state_collection.document(self.ROLLUP_STATE_ID).get()
+            if not state.exists or state.to_dict()["since"] > start_date:
+                return None
+
+            days = range((end_date - start_date).days)
+            refs = [
+                self.rollups_collection.document(
+                    self._rollup_id(start_date + timedelta(days=offset), shard)
+                )
+                for offset in days
+                for shard in range(self.ROLLUP_SHARDS)
+            ]
+            return self._merge_stats(
+                snapshot.to_dict()
+                for snapshot in self.db.get_all(refs)
+                if snapshot.exists
+            )
+
+        except Exception as e:
+            logger.warning("Reading rollups failed, aggregating instead: %s", e)
+            return None
+
+    def _aggregate_week(
+        self, start_date: datetime, end_date: datetime
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Compute the week's metrics with server-side count/sum aggregations
+
+        Breakdowns are counted per catalog value (models from the validator,
+        sizes/styles/colors from their configuration collections), so each
+        must add up to the total for the result to be exact.
+
+        Args:
+            start_date: Week start date
+            end_date: Week end date
+
+        Returns:
+            Report metrics, or None if the catalogs are empty, a breakdown
+            doesn't account for every request, or an aggregation fails
+        """
+        try:
+            dimensions = {"model": sorted(RequestValidator.VALID_MODELS)}
+            for field, collection in self.CATALOG_COLLECTIONS.items():
+                dimensions[field] = [
+                    doc.id for doc in self.db.collection(collection).stream()
+                ]
+            if not all(dimensions.values()):
+                return None
+
+            requests_query = self.requests_collection.where(
+                "createdAt", ">=", start_date
+            ).where("createdAt", "<", end_date)
+
+            completed_query = requests_query.where("status", "==", "completed")
+            transactions_query = self.transactions_collection.where(
+                "timestamp", ">=", start_date
+            ).where("timestamp", "<", end_date)
+
+            # The aggregations are independent, so prepare all of them and
+            # run them concurrently: the wall time is one round trip, not the
+            # sum of them
+            aggregations = {
+                "totalRequests": requests_query.count(alias="total"),
+                "successfulRequests": completed_query.count(alias="total"),
+                "failedRequests": requests_query.where("status", "==", "failed").count(
+                    alias="total"
+                ),
+                "totalCreditsConsumed": transactions_query.where(
+                    "type", "==", "deduction"
+                ).sum("credits", alias="total"),
+                "totalCreditsRefunded": transactions_query.where(
+                    "type", "==", "refund"
+                ).sum("credits", alias="total"),
+            }
+            # One count per catalog value rather than an "in" query grouped
+            # client-side: a count is billed per 1000 matches, while grouping
+            # would read every request document
+            for field, values in dimensions.items():
+                for value in values:
+                    aggregations[field, value] = requests_query.where(
+                        field, "==", value
+                    ).count(alias="count")
+            # Credits are only attributed to completed requests
+            for size in dimensions["size"]:
+                aggregations["creditsBySize", size] = (
+                    completed_query.where("size", "==", size)
+                    .count(alias="count")
+                    .sum("creditsCharged", alias="credits")
+                )
+
+            with ThreadPoolExecutor(max_workers=self.AGGREGATION_WORKERS) as executor:
+                results = dict(
+                    zip(
+                        aggregations,
+                        executor.map(self._aggregate, aggregations.values()),
+                    )
+                )
+
+            total_requests = results["totalRequests"]["total"]
+            breakdowns = {}
+            for field, values in dimensions.items():
+                counts = {
+                    value: count
+                    for value in values
+                    if (count := results[field, value]["count"])
+                }
+                if sum(counts.values()) != total_requests:
+                    logger.info("Requests outside the %s catalog, scanning", field)
+                    return None
+                breakdowns[field] = counts
+
+            return {
+                **{key: results[key]["total"] for key in self.TOTAL_FIELDS},
+                "requestsByModel": breakdowns["model"],
+                "requestsBySize": breakdowns["size"],
+                "requestsByStyle": breakdowns["style"],
+                "requestsByColor": breakdowns["color"],
+                "creditsBySize": {
+                    size: completed["credits"]
+                    for size in dimensions["size"]
+                    if (completed := results["creditsBySize", size])["count"]
+                },
+            }
+
+        except Exception as e:
+            logger.warning("Aggregation failed, scanning instead: %s", e)
+            return None
+
+    @staticmethod
+    def _aggregate(aggregation_query) -> Dict[str, Any]:
+        """Run an aggregation query and map each alias to its value"""
+        return {result.alias: result.value for result in aggregation_query.get()[0]}
+
+    def _scan_requests(
+        self, start_date: datetime, end_date: datetime
+    ) -> Dict[str, Any]:
+        """
+        Compute the week's request metrics by scanning one day at a time
+
+        Days are scanned concurrently, each in short paged queries rather
+        than one long-lived stream over the whole week.
+
+        Args:
+            start_date: Week start date
+            end_date: Week end date
+
+        Returns:
+            Request counts and breakdowns
+        """
+        days = [
+            start_date + timedelta(days=offset)
+            for offset in range((end_date - start_date).days)
+        ]
+        with ThreadPoolExecutor(max_workers=len(days)) as executor:
+            day_stats = executor.map(
+                lambda day: self._scan_requests_window(day, day + timedelta(days=1)),
+                days,
+            )
+
+            return self._merge_stats(day_stats)
+
+    def _scan_requests_window(
+        self, start_date: datetime, end_date: datetime
+    ) -> Dict[str, Any]:
+        """
+        Compute request metrics for a time window, paging with cursors
+
+        Args:
+            start_date: Window start (inclusive)
+            end_date: Window end (exclusive)
+
+        Returns:
+            Request counts and breakdowns for the window
+        """
+        requests_query = (
+            self.requests_collection.where("createdAt", ">=", start_date)
+            .where("createdAt", "<", end_date)
+            .order_by("createdAt")
+            .select(self.REQUEST_SCAN_FIELDS)
+            .limit(self.SCAN_PAGE_SIZE)
+        )
+
+        # Initialize counters
+        requests_by_status = Counter()
+        requests_by_model = Counter()
+        requests_by_size = Counter()
+        requests_by_style = Counter()
+        requests_by_color = Counter()
+        credits_by_size = defaultdict(int)
+
+        # (field, default) per column, bound once instead of per page
+        columns = tuple(self.REQUEST_SCAN_DEFAULTS.items())
+
+        # Process each page of requests column by column: gather each field
+        # into a list and let Counter tally the whole column in C
+        last_doc = None
+        while True:
+            page_query = (
+                requests_query.start_after(last_doc) if last_doc else requests_query
+            )
+            docs = list(page_query.stream())
+            # Read each column straight from the documents, defaulting
+            # missing fields per column without copying any document
+            records = [doc.to_dict() for doc in docs]
+            statuses, models, sizes, styles, colors, credits = (
+                [record.get(field, default) for record in records]
+                for field, default in columns
+            )
+
+            requests_by_status.update(statuses)
+            requests_by_model.update(models)
+            requests_by_size.update(sizes)
+            requests_by_style.update(styles)
+            requests_by_color.update(colors)
+
+            for status, size, charged in zip(statuses, sizes, credits):
+                if status == "completed":
+                    credits_by_size[size] += charged
+
+            if len(docs) < self.SCAN_PAGE_SIZE:
+                break
+            last_doc = docs[-1]
+
+        return {
+            "totalRequests": sum(requests_by_status.values()),
+            "successfulRequests": requests_by_status["completed"],
+            "failedRequests": requests_by_status["failed"],
+            "requestsByModel": dict(requests_by_model),
+            "requestsBySize": dict(requests_by_size),
+            "requestsByStyle": dict(requests_by_style),
+            "requestsByColor": dict(requests_by_color),
+            "creditsBySize": dict(credits_by_size),
+        }
+
+    def _scan_transactions(
+        self, start_date: datetime, end_date: datetime
+    ) -> Dict[str, int]:
+        """
+        Compute the week's credit totals by streaming every transaction
+
+        Args:
+            start_date: Week start date
+            end_date: Week end date
+
+        Returns:
+            Credits consumed and refunded
+        """
+        # Fetch credit transactions for the week
+        transactions_query = self.transactions_collection.where(
+            "timestamp", ">=", start_date
+        ).where("timestamp", "<", end_date)
+
+        total_credits_consumed = 0
+        total_credits_refunded = 0
+
+        for doc in transactions_query.select(self.TRANSACTION_SCAN_FIELDS).stream():
+            transaction_data = doc.to_dict()
+            transaction_type = transaction_data.get("type")
+            credits = transaction_data.get("credits", 0)
+
+            if transaction_type == "deduction":
+                total_credits_consumed += credits
+            elif transaction_type == "refund":
+                total_credits_refunded += credits
+
+        return {
+            "totalCreditsConsumed": total_credits_consumed,
+            "totalCreditsRefunded": total_credits_refunded,
+        }
+
+    def _get_previous_report(self, start_date: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Get the report of the week before the given week
+
+        Args:
+            start_date: Week start date
+
+        Returns:
+            Previous week's report data, or None if not found
+        """
+        previous_week_start = start_date - timedelta(days=7)
+        cached = self._report_cache.get(previous_week_start)
+        if cached is not None:
+            return cached
+
+        try:
+            # Reports saved before weekStartDate became a timestamp hold
+            # the ISO string, so match either form
+            previous_report_query = self.reports_collection.where(
+                "weekStartDate",
+                "in",
+                [previous_week_start, previous_week_start.isoformat()],
+            ).limit(1)
+
+            for doc in previous_report_query.stream():
+                # Only found reports are cached; a missing one may be
+                # written by a later run
+                report = doc.to_dict()
+                self._report_cache[previous_week_start] = report
+                return report
+
+        except Exception as e:
+            logger.error("Error getting previous report: %s", e)
+
+        return None
+
     def _detect_anomalies(
         self,
         total_requests: int,
         failed_requests: int,
         requests_by_model: Dict[str, int],
-        start_date: datetime,
+        previous_report: Optional[Dict[str, Any]],
     ) -> List[Dict[str, Any]]:
         """
         Detect anomalies in usage patterns
@@ -153,7 +617,7 @@ class ReportService:
             total_requests: Total number of requests
             failed_requests: Number of failed requests
             requests_by_model: Request count by model
-            start_date: Week start date
+            previous_report: Previous week's report for comparison, if any
 
         Returns:
             List of detected anomalies
@@ -161,81 +625,77 @@ class ReportService:
         anomalies = []
 
         try:
-            # Get previous week's report for comparison
-            previous_week_start = start_date - timedelta(days=7)
-            previous_report_query = self.reports_collection.where(
-                "weekStartDate", "==", previous_week_start.isoformat()
-            ).limit(1)
-
-            previous_report = None
-            for doc in previous_report_query.stream():
-                previous_report = doc.to_dict()
-                break
+            # Rates are computed once up front; an empty week has none
+            failure_rate = (
+                (failed_requests / total_requests) * 100 if total_requests else 0
+            )
+            model_percents = (
+                {
+                    model: (count / total_requests) * 100
+                    for model, count in requests_by_model.items()
+                }
+                if total_requests
+                else {}
+            )
 
-            if previous_report:
-                # Check for significant request volume changes (>50% change)
-                prev_total = previous_report.get("totalRequests", 0)
-                if prev_total > 0:
-                    change_percent = ((total_requests - prev_total) / prev_total) * 100
-                    if abs(change_percent) > 50:
-                        anomalies.append(
-                            {
-                                "type": "request_volume_spike",
-                                "description": f"Request volume changed by {change_percent:.1f}%",
-                                "severity": "high"
-                                if abs(change_percent) > 100
-                                else "medium",
-                                "currentValue": total_requests,
-                                "previousValue": prev_total,
-                            }
-                        )
-
-                # Check for high failure rate (>10%)
-                if total_requests > 0:
-                    failure_rate = (failed_requests / total_requests) * 100
-                    if failure_rate > 10:
-                        anomalies.append(
-                            {
-                                "type": "high_failure_rate",
-                                "description": f"Failure rate is {failure_rate:.1f}%",
-                                "severity": "high" if failure_rate > 20 else "medium",
-                                "failureRate": failure_rate,
-                            }
-                        )
-
-                # Check for model imbalance (one model >80% of requests)
-                for model, count in requests_by_model.items():
-                    if total_requests > 0:
-                        model_percent = (count / total_requests) * 100
-                        if model_percent > 80:
-                            anomalies.append(
-                                {
-                                    "type": "model_imbalance",
-                                    "description": f"{model} accounts for {model_percent:.1f}% of requests",
-                                    "severity": "low",
-                                    "model": model,
-                                    "percentage": model_percent,
-                                }
-                            )
-
-            # Always check absolute failure rate even without previous data
-            elif total_requests > 0:
-                failure_rate = (failed_requests / total_requests) * 100
-                if failure_rate > 10:
+            # Check for significant request volume changes (>50% change)
+            prev_total = (
+                previous_report.get("totalRequests", 0) if previous_report else 0
+            )
+            if prev_total > 0:
+                change_percent = ((total_requests - prev_total) / prev_total) * 100
+                if abs(change_percent) > 50:
                     anomalies.append(
                         {
-                            "type": "high_failure_rate",
-                            "description": f"Failure rate is {failure_rate:.1f}%",
-                            "severity": "high" if failure_rate > 20 else "medium",
-                            "failureRate": failure_rate,
+                            "type": "request_volume_spike",
+                            "description": f"Request volume changed by {change_percent:.1f}%",
+                            "severity": "high"
+                            if abs(change_percent) > 100
+                            else "medium",
+                            "currentValue": total_requests,
+                            "previousValue": prev_total,
                         }
                     )
 
+            # Check for high failure rate (>10%), even without previous data
+            if failure_rate > 10:
+                anomalies.append(
+                    {
+                        "type": "high_failure_rate",
+                        "description": f"Failure rate is {failure_rate:.1f}%",
+                        "severity": "high" if failure_rate > 20 else "medium",
+                        "failureRate": failure_rate,
+                    }
+                )
+
+            # Check for model imbalance (one model >80% of requests) when
+            # there is a previous week to compare against
+            if previous_report:
+                anomalies.extend(
+                    {
+                        "type": "model_imbalance",
+                        "description": f"{model} accounts for {model_percent:.1f}% of requests",
+                        "severity": "low",
+                        "model": model,
+                        "percentage": model_percent,
+                    }
+                    for model, model_percent in model_percents.items()
+                    if model_percent > 80
+                )
+
         except Exception as e:
-            logger.error(f"Error detecting anomalies: {str(e)}")
+            logger.error("Error detecting anomalies: %s", e)
 
         return anomalies
 
+    @staticmethod
+    def _week_start(report: Dict[str, Any]) -> datetime:
+        """A report's weekStartDate, parsing the legacy ISO string form"""
+        week_start = report["weekStartDate"]
+        if isinstance(week_start, str):
+            return datetime.fromisoformat(week_start)
+        return week_start
+
     def get_report_by_date_range(
         self, start_date: datetime, end_date: datetime
     ) -> List[Dict[str, Any]]:
@@ -250,22 +710,26 @@ class ReportService:
             List of report documents
         """
         try:
-            query = (
-                self.reports_collection.where(
-                    "weekStartDate", ">=", start_date.isoformat()
+            # Reports saved before weekStartDate became a timestamp hold the
+            # ISO string, and Firestore ranges never mix value types, so
+            # query each form and merge the results
+            reports = {}
+            for range_start, range_end in (
+                (start_date, end_date),
+                (start_date.isoformat(), end_date.isoformat()),
+            ):
+                query = (
+                    self.reports_collection.where("weekStartDate", ">=", range_start)
+                    .where("weekStartDate", "<=", range_end)
+                    .order_by("weekStartDate", direction=firestore.Query.DESCENDING)
                 )
-                .where("weekStartDate", "<=", end_date.isoformat())
-                .order_by("weekStartDate", direction=firestore.Query.DESCENDING)
-            )
-
-            reports = []
-            for doc in query.stream():
-                report_data = doc.to_dict()
-                report_data["reportId"] = doc.id
-                reports.append(report_data)
+                for doc in query.stream():
+                    report_data = doc.to_dict()
+                    report_data["reportId"] = doc.id
+                    reports[doc.id] = report_data
 
-            return reports
+            return sorted(reports.values(), key=self._week_start, reverse=True)
 
         except Exception as e:
-            logger.error(f"Error getting reports: {str(e)}")
+            logger.error("Error getting reports: %s", e)
             return []
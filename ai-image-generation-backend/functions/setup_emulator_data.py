@@ -1,57 +1,88 @@
+import orjson
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 
 FIRESTORE_EMULATOR_URL = "http://localhost:8080"
 PROJECT_ID = "case-study-feraset"
 
+# Firestore accepts at most 500 writes per commit
+MAX_BATCH_WRITES = 500
+
+# Reuse keep-alive connections to the emulator across calls
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+# Datetimes are left for orjson to write as RFC 3339; naive ones are UTC
+JSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC
+
+
+def _encode_timestamp(value):
+    return {"timestampValue": value}
+
+
+def _encode_map(value):
+    return {
+        "mapValue": {"fields": {k: to_firestore_value(v) for k, v in value.items()}}
+    }
+
+
+def _encode_array(value):
+    return {"arrayValue": {"values": [to_firestore_value(v) for v in value]}}
+
+
+# Encoders keyed by exact type; bool precedes int for the subclass fallback
+# since bool is a subclass of int
+_ENCODERS = {
+    str: lambda v: {"stringValue": v},
+    bool: lambda v: {"booleanValue": v},
+    int: lambda v: {"integerValue": str(v)},  # MUST be string!
+    float: lambda v: {"doubleValue": v},
+    datetime: _encode_timestamp,
+    type(None): lambda v: {"nullValue": None},
+    dict: _encode_map,
+    list: _encode_array,
+}
+
 
 def to_firestore_value(value):
-    if isinstance(value, str):
-        return {"stringValue": value}
-    elif isinstance(value, bool):  # Check bool before int since bool is subclass of int
-        return {"booleanValue": value}
-    elif isinstance(value, int):
-        return {"integerValue": str(value)}  # MUST be string!
-    elif isinstance(value, float):
-        return {"doubleValue": value}
-    elif isinstance(value, datetime):
-        return {
-            "timestampValue": value.astimezone(timezone.utc)
-            .isoformat(timespec="milliseconds")
-            .replace("+00:00", "Z")
-        }
-    elif value is None:
-        return {"nullValue": None}
-    elif isinstance(value, dict):
-        return {
-            "mapValue": {"fields": {k: to_firestore_value(v) for k, v in value.items()}}
-        }
-    elif isinstance(value, list):
-        return {"arrayValue": {"values": [to_firestore_value(v) for v in value]}}
-    else:
-        raise TypeError(f"Unsupported type: {type(value)}")
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        # Subclasses of the supported types
+        for value_type, candidate in _ENCODERS.items():
+            if isinstance(value, value_type):
+                encoder = candidate
+                break
+        else:
+            raise TypeError(f"Unsupported type: {type(value)}")
+    return encoder(value)
+
 
+DOCUMENTS_PATH = f"projects/{PROJECT_ID}/databases/(default)/documents"
 
-def create_document(collection, doc_id, data):
-    # Use POST with documentId parameter for consistent behavior
-    url = f"{FIRESTORE_EMULATOR_URL}/v1/projects/{PROJECT_ID}/databases/(default)/documents/{collection}"
 
+def document_write(collection, doc_id, data):
+    # Full-document update; creates the document or replaces an existing one
     fields = {k: to_firestore_value(v) for k, v in data.items()}
-    payload = {"fields": fields}
+    name = f"{DOCUMENTS_PATH}/{collection}/{doc_id}"
+    return {"update": {"name": name, "fields": fields}}
 
-    # Add documentId to URL parameters if specified
-    params = {}
-    if doc_id:
-        params["documentId"] = doc_id
 
-        headers = {"Content-Type": "application/json"}
+def commit_writes(writes):
+    # A single :commit call applies every write atomically
+    url = f"{FIRESTORE_EMULATOR_URL}/v1/{DOCUMENTS_PATH}:commit"
+    headers = {"Content-Type": "application/json"}
 
-    response = requests.post(url, json=payload, headers=headers, params=params)
+    response = SESSION.post(
+        url, data=orjson.dumps({"writes": writes}, option=JSON_OPTIONS), headers=headers
+    )
 
-    if response.status_code in [200, 201]:
-        print(f"  ✓ Created {collection}/{doc_id}")
+    if response.status_code == 200:
+        print(f"  ✓ Committed {len(writes)} documents")
     else:
-        print(f"  ✗ Failed to create {collection}/{doc_id}: {response.text}")
+        print(f"  ✗ Failed to commit {len(writes)} documents: {response.text}")
 
 
 def setup_test_data():
@@ -59,6 +90,7 @@ def setup_test_data():
     print("=" * 50)
 
     now = datetime.now(timezone.utc)
+    writes = []
 
     # Users
     print("\nCreating test users...")
@@ -96,22 +128,26 @@ def setup_test_data():
     ]
 
     for uid, data in users:
-        create_document("users", uid, data)
+        writes.append(document_write("users", uid, data))
 
     # Colors
     print("\nCreating colors...")
     colors = ["vibrant", "monochrome", "pastel", "neon", "vintage"]
     for color in colors:
-        create_document(
-            "colors", color, {"name": color, "active": True, "createdAt": now}
+        writes.append(
+            document_write(
+                "colors", color, {"name": color, "active": True, "createdAt": now}
+            )
         )
 
     # Styles
     print("\nCreating styles...")
     styles = ["realistic", "anime", "oil painting", "sketch", "cyberpunk", "watercolor"]
     for style in styles:
-        create_document(
-            "styles", style, {"name": style, "active": True, "createdAt": now}
+        writes.append(
+            document_write(
+                "styles", style, {"name": style, "active": True, "createdAt": now}
+            )
         )
 
     # Sizes
@@ -130,7 +166,16 @@ def setup_test_data():
 
     for size_id, data in sizes:
         data.update({"active": True, "createdAt": now})
-        create_document("sizes", size_id, data)
+        writes.append(document_write("sizes", size_id, data))
+
+    print("\nCommitting test data...")
+    batches = [
+        writes[i : i + MAX_BATCH_WRITES]
+        for i in range(0, len(writes), MAX_BATCH_WRITES)
+    ]
+    # Batches are independent, so commit them concurrently
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(commit_writes, batches))
 
     print("\n✅ Test data setup complete!")
     print("You can view the data in the Emulator UI at: http://localhost:4000")
@@ -138,7 +183,7 @@ def setup_test_data():
 
 if __name__ == "__main__":
     try:
-        requests.get(f"{FIRESTORE_EMULATOR_URL}/")
+        SESSION.get(f"{FIRESTORE_EMULATOR_URL}/")
         print("✓ Firestore emulator is running")
         setup_test_data()
     except requests.exceptions.ConnectionError:
@@ -0,0 +1,20 @@
+"""
+tests/conftest.py - Shared test setup
+"""
+
+import sys
+from unittest.mock import MagicMock
+
+# Stub the Firebase Admin SDK when it isn't installed. This runs once at
+# import, before any test module is collected; a fixture, even a
+# session-scoped autouse one, would only run after the services imported it.
+try:
+    import firebase_admin  # noqa: F401
+except ImportError:
+    for name in (
+        "firebase_admin",
+        "firebase_admin.firestore",
+        "firebase_admin.initialize_app",
+        "firebase_admin.credentials",
+    ):
+        sys.modules.setdefault(name, MagicMock())
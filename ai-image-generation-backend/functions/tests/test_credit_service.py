@@ -3,9 +3,14 @@ tests/test_credit_service.py - Tests for credit service
 """
 
 import pytest
-from unittest.mock import Mock, patch
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
 from datetime import datetime, timezone
-from services.credit_service import CreditService
+from services.credit_service import CreditService, DeductionStatus
+
+# Prebuilt Firestore mock tree shared by the credit service tests
+FirestoreChain = namedtuple("FirestoreChain", "db user_ref user_doc trans_ref")
 
 
 class TestCreditService:
@@ -15,21 +20,32 @@ class TestCreditService:
         return Mock()
 
     @pytest.fixture
-    def credit_service(self, mock_db):
+    def firestore_chain(self, mock_db):
+        """Wire the users/credit_transactions references of the mock DB"""
+        user_doc = Mock()
+        user_doc.exists = True
+        user_doc.to_dict.return_value = {"credits": 50}
+
+        user_ref = Mock()
+        user_ref.get.return_value = user_doc
+
+        trans_ref = Mock()
+        trans_ref.id = "trans123"
+
+        collections = {"users": Mock(), "credit_transactions": Mock()}
+        collections["users"].document.return_value = user_ref
+        collections["credit_transactions"].document.return_value = trans_ref
+        mock_db.collection.side_effect = collections.__getitem__
+
+        return FirestoreChain(mock_db, user_ref, user_doc, trans_ref)
+
+    @pytest.fixture
+    def credit_service(self, firestore_chain):
         """Create CreditService instance with mock DB"""
-        return CreditService(mock_db)
+        return CreditService(firestore_chain.db)
 
     def test_get_user_credits_existing_user(self, credit_service, mock_db):
         """Test getting credits for existing user"""
-        # Mock user document
-        mock_doc = Mock()
-        mock_doc.exists = True
-        mock_doc.to_dict.return_value = {"credits": 50}
-
-        mock_db.collection.return_value.document.return_value.get.return_value = (
-            mock_doc
-        )
-
         # Test
         credits = credit_service.get_user_credits("user123")
 
@@ -37,86 +53,136 @@ class TestCreditService:
         # Check that collection was called with "users" at some point
         mock_db.collection.assert_any_call("users")
 
-    def test_get_user_credits_nonexistent_user(self, credit_service, mock_db):
+    def test_get_user_credits_nonexistent_user(self, credit_service, firestore_chain):
         """Test getting credits for non-existent user returns 0"""
         # Mock non-existent user
-        mock_doc = Mock()
-        mock_doc.exists = False
-
-        mock_db.collection.return_value.document.return_value.get.return_value = (
-            mock_doc
-        )
+        firestore_chain.user_doc.exists = False
 
         # Test
         credits = credit_service.get_user_credits("nonexistent")
 
         assert credits == 0
 
-    def test_deduct_credits_success(self, credit_service, mock_db):
-        """Test successful credit deduction"""
-        # Mock transaction and user document
-        mock_transaction = Mock()
-        mock_user_doc = Mock()
-        mock_user_doc.exists = True
-        mock_user_doc.to_dict.return_value = {"credits": 50}
+    def test_get_user_credits_cached(self, credit_service, firestore_chain):
+        """Test repeated balance reads are served from the TTL cache"""
+        mock_get = firestore_chain.user_ref.get
+
+        assert credit_service.get_user_credits("user123") == 50
+        assert credit_service.get_user_credits("user123") == 50
+        assert mock_get.call_count == 1
 
-        mock_transaction.get.return_value = mock_user_doc
+    def test_get_user_credits_cache_invalidated_by_refund(
+        self, credit_service, firestore_chain
+    ):
+        """Test staging a refund drops the cached balance"""
+        mock_get = firestore_chain.user_ref.get
 
-        # Mock document references
-        mock_user_ref = Mock()
-        mock_transaction_ref = Mock()
-        mock_transaction_ref.id = "trans123"
+        credit_service.get_user_credits("user123")
+        credit_service.build_refund_batch(Mock(), "user123", 3, "req123")
+        firestore_chain.user_doc.to_dict.return_value = {"credits": 53}
 
-        mock_db.collection.return_value.document.side_effect = [
-            mock_user_ref,  # First call for user
-            mock_transaction_ref,  # Second call for transaction
-        ]
+        assert credit_service.get_user_credits("user123") == 53
+        assert mock_get.call_count == 2
+
+    def test_credit_cache_concurrent_eviction(self, credit_service):
+        """Test the cache stays bounded when request threads fill it at once"""
+        credit_service.CREDIT_CACHE_MAX_SIZE = 8
+
+        def fill(worker):
+            for i in range(500):
+                credit_service._cache_credits(f"user{worker}_{i}", i)
+                credit_service._invalidate_credits(f"user{worker}_{i - 1}")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(fill, range(8)))
+
+        assert len(credit_service._credit_cache) <= 8
+
+    def test_deduct_credits_success(self, credit_service, firestore_chain):
+        """Test successful credit deduction"""
+        # Mock transaction reading the user document
+        mock_transaction = Mock()
+        mock_transaction.get.return_value = firestore_chain.user_doc
 
         # Test
-        result = credit_service.deduct_credits(
+        status, current_credits = credit_service.deduct_credits(
             mock_transaction, "user123", 10, "req123"
         )
 
-        assert result is True
+        assert status == DeductionStatus.OK
+        assert current_credits == 50
+        mock_transaction.get.assert_called_once_with(firestore_chain.user_ref)
         mock_transaction.update.assert_called_once()
         mock_transaction.set.assert_called_once()
+        assert mock_transaction.set.call_args[0][0] is firestore_chain.trans_ref
 
-    def test_deduct_credits_insufficient_funds(self, credit_service, mock_db):
+    def test_deduct_credits_insufficient_funds(self, credit_service, firestore_chain):
         """Test credit deduction with insufficient funds"""
         # Mock transaction and user document
         mock_transaction = Mock()
-        mock_user_doc = Mock()
-        mock_user_doc.exists = True
-        mock_user_doc.to_dict.return_value = {"credits": 5}
-
-        mock_transaction.get.return_value = mock_user_doc
-
-        # Mock user reference
-        mock_user_ref = Mock()
-        mock_db.collection.return_value.document.return_value = mock_user_ref
+        firestore_chain.user_doc.to_dict.return_value = {"credits": 5}
+        mock_transaction.get.return_value = firestore_chain.user_doc
 
         # Test
-        result = credit_service.deduct_credits(
+        status, current_credits = credit_service.deduct_credits(
             mock_transaction, "user123", 10, "req123"
         )
 
-        assert result is False
+        assert status == DeductionStatus.INSUFFICIENT
+        assert current_credits == 5
         mock_transaction.update.assert_not_called()
 
+    def test_get_balance_snapshot_existing_user(self, credit_service, firestore_chain):
+        """Test reading balance and update time for existing user"""
+        update_time = datetime.now(timezone.utc)
+        firestore_chain.user_doc.update_time = update_time
+
+        assert credit_service.get_balance_snapshot("user123") == (50, update_time)
+
+    def test_get_balance_snapshot_nonexistent_user(
+        self, credit_service, firestore_chain
+    ):
+        """Test reading balance for non-existent user"""
+        firestore_chain.user_doc.exists = False
+
+        assert credit_service.get_balance_snapshot("nonexistent") == (0, None)
+
+    def test_build_deduction_batch(self, credit_service, firestore_chain):
+        """Test deduction writes are staged on the batch without a read"""
+        mock_db = firestore_chain.db
+        mock_batch = Mock()
+        update_time = datetime.now(timezone.utc)
+
+        # Test
+        credit_service.build_deduction_batch(
+            mock_batch, "user123", 3, "req123", update_time
+        )
+
+        mock_db.write_option.assert_called_once_with(last_update_time=update_time)
+        mock_batch.update.assert_called_once()
+        assert mock_batch.update.call_args[0][0] is firestore_chain.user_ref
+        firestore_chain.user_ref.get.assert_not_called()
+        mock_batch.set.assert_called_once()
+        transaction_data = mock_batch.set.call_args[0][1]
+        assert transaction_data["type"] == "deduction"
+        assert transaction_data["credits"] == 3
+        assert transaction_data["generationRequestId"] == "req123"
+
     def test_refund_credits_success(self, credit_service, mock_db):
         """Test successful credit refund"""
-        with patch("firebase_admin.firestore.transactional") as mock_transactional:
-            # Setup mock transaction
-            mock_transaction_instance = Mock()
-            mock_db.transaction.return_value = mock_transaction_instance
+        mock_batch = mock_db.batch.return_value
 
-            # Mock the transactional decorator to just call the function
-            mock_transactional.side_effect = lambda func: func
-
-            # Test
-            _ = credit_service.refund_credits("user123", 10, "req123")
+        # Test
+        result = credit_service.refund_credits("user123", 10, "req123")
 
-            assert mock_db.transaction.called
+        assert result is True
+        assert mock_batch.set.call_count == 2  # user increment + refund record
+        assert mock_batch.set.call_args_list[0][1] == {"merge": True}
+        refund_data = mock_batch.set.call_args_list[1][0][1]
+        assert refund_data["type"] == "refund"
+        assert refund_data["credits"] == 10
+        mock_batch.commit.assert_called_once()
+        mock_db.transaction.assert_not_called()
 
     def test_get_transaction_history(self, credit_service, mock_db):
         """Test getting transaction history"""
@@ -142,10 +208,10 @@ class TestCreditService:
         # Mock the Firestore query chain
         mock_stream = [mock_doc1, mock_doc2]
         mock_limit = Mock()
-        mock_limit.stream.return_value = mock_stream
+        mock_limit.select.return_value.stream.return_value = mock_stream
 
         mock_order_by = Mock()
-        mock_order_by.limit.return_value = mock_limit
+        mock_order_by.order_by.return_value.limit.return_value = mock_limit
 
         mock_where = Mock()
         mock_where.order_by.return_value = mock_order_by
@@ -161,75 +227,101 @@ class TestCreditService:
         assert len(transactions) == 2
         assert transactions[0]["transactionId"] == "trans1"
         assert transactions[1]["transactionId"] == "trans2"
+        mock_limit.select.assert_called_once_with(
+            ["type", "credits", "generationRequestId", "timestamp"]
+        )
 
-    def test_create_user_with_credits_success(self, credit_service, mock_db):
-        """Test successful user creation with credits"""
-        # Mock document references
-        mock_user_ref = Mock()
-        mock_transaction_ref = Mock()
-        mock_transaction_ref.id = "trans123"
+    def test_get_transaction_history_start_after(self, credit_service, mock_db):
+        """Test paging transaction history from a decoded cursor"""
+        mock_doc = Mock()
+        mock_doc.id = "trans3"
+        mock_doc.to_dict.return_value = {"type": "deduction", "credits": 1}
+
+        mock_limit = Mock()
+        mock_page = mock_limit.start_after.return_value
+        mock_page.select.return_value.stream.return_value = [mock_doc]
+
+        mock_transactions_collection = Mock()
+        mock_query = mock_transactions_collection.where.return_value
+        mock_query.order_by.return_value.order_by.return_value.limit.return_value = (
+            mock_limit
+        )
+        credit_service.transactions_collection = mock_transactions_collection
+
+        # Test
+        timestamp = datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc)
+        transactions = credit_service.get_transaction_history(
+            "user123", limit=2, start_after=(timestamp, "trans2")
+        )
 
-        mock_db.collection.return_value.document.side_effect = [
-            mock_user_ref,  # users collection
-            mock_transaction_ref,  # transactions collection
-            mock_transaction_ref,  # transactions collection for set
-        ]
+        # The cursor is applied on field values, without reading the document
+        mock_transactions_collection.document.assert_not_called()
+        mock_limit.start_after.assert_called_once_with(
+            {"timestamp": timestamp, "__name__": "trans2"}
+        )
+        assert [t["transactionId"] for t in transactions] == ["trans3"]
+
+    def test_history_cursor_round_trip(self):
+        """Test a cursor decodes to the transaction it was built from"""
+        timestamp = datetime(2025, 1, 15, 10, 30, 0, 123456, tzinfo=timezone.utc)
+        cursor = CreditService.encode_cursor(
+            {"transactionId": "trans_2", "timestamp": timestamp}
+        )
 
+        assert CreditService.decode_cursor(cursor) == (timestamp, "trans_2")
+
+    @pytest.mark.parametrize(
+        "cursor", ["trans2", "_trans2", "123_", "-5_trans2", "123_users/other"]
+    )
+    def test_decode_cursor_invalid(self, cursor):
+        """Test malformed cursors are rejected"""
+        with pytest.raises(ValueError):
+            CreditService.decode_cursor(cursor)
+
+    def test_create_user_with_credits_success(self, credit_service, firestore_chain):
+        """Test successful user creation with credits"""
         # Test
         result = credit_service.create_user_with_credits(
             "user123", 50, "test@example.com"
         )
 
         assert result is True
-        mock_user_ref.set.assert_called_once()
+        firestore_chain.user_ref.set.assert_called_once()
+        firestore_chain.trans_ref.set.assert_called_once()
 
-    def test_create_user_with_credits_default_amount(self, credit_service, mock_db):
+    def test_create_user_with_credits_default_amount(
+        self, credit_service, firestore_chain
+    ):
         """Test user creation with default credit amount"""
-        # Mock document references
-        mock_user_ref = Mock()
-        mock_transaction_ref = Mock()
-        mock_transaction_ref.id = "trans123"
-
-        mock_db.collection.return_value.document.side_effect = [
-            mock_user_ref,
-            mock_transaction_ref,
-            mock_transaction_ref,
-        ]
-
         # Test with default credits (should be 50)
         result = credit_service.create_user_with_credits("user123")
 
         assert result is True
+        assert firestore_chain.user_ref.set.call_args[0][0]["credits"] == 50
 
-    def test_get_user_credits_error_handling(self, credit_service, mock_db):
+    def test_get_user_credits_error_handling(self, credit_service, firestore_chain):
         """Test error handling in get_user_credits"""
         # Mock database error
-        mock_db.collection.return_value.document.return_value.get.side_effect = (
-            Exception("DB error")
-        )
+        firestore_chain.user_ref.get.side_effect = Exception("DB error")
 
         # Should return 0 on error
         credits = credit_service.get_user_credits("user123")
         assert credits == 0
 
-    def test_deduct_credits_user_not_found(self, credit_service, mock_db):
+    def test_deduct_credits_user_not_found(self, credit_service, firestore_chain):
         """Test deduct_credits when user doesn't exist"""
         # Mock transaction and non-existent user
         mock_transaction = Mock()
-        mock_user_doc = Mock()
-        mock_user_doc.exists = False
-
-        mock_transaction.get.return_value = mock_user_doc
-
-        mock_user_ref = Mock()
-        mock_db.collection.return_value.document.return_value = mock_user_ref
+        firestore_chain.user_doc.exists = False
+        mock_transaction.get.return_value = firestore_chain.user_doc
 
         # Test
-        result = credit_service.deduct_credits(
+        status, current_credits = credit_service.deduct_credits(
             mock_transaction, "user123", 10, "req123"
         )
 
-        assert result is False
+        assert status == DeductionStatus.MISSING
+        assert current_credits == 0
 
     def test_deduct_credits_error_handling(self, credit_service, mock_db):
         """Test error handling in deduct_credits"""
@@ -237,20 +329,17 @@ class TestCreditService:
         mock_transaction = Mock()
         mock_transaction.get.side_effect = Exception("Transaction error")
 
-        mock_user_ref = Mock()
-        mock_db.collection.return_value.document.return_value = mock_user_ref
-
         # Test
-        result = credit_service.deduct_credits(
+        status, _ = credit_service.deduct_credits(
             mock_transaction, "user123", 10, "req123"
         )
 
-        assert result is False
+        assert status == DeductionStatus.ERROR
 
     def test_refund_credits_error_handling(self, credit_service, mock_db):
         """Test error handling in refund_credits"""
         # Mock database error
-        mock_db.transaction.side_effect = Exception("Transaction error")
+        mock_db.batch.return_value.commit.side_effect = Exception("Commit error")
 
         # Test
         result = credit_service.refund_credits("user123", 10, "req123")
@@ -269,12 +358,12 @@ class TestCreditService:
 
         assert transactions == []
 
-    def test_create_user_with_credits_error_handling(self, credit_service, mock_db):
+    def test_create_user_with_credits_error_handling(
+        self, credit_service, firestore_chain
+    ):
         """Test error handling in create_user_with_credits"""
         # Mock database error
-        mock_db.collection.return_value.document.return_value.set.side_effect = (
-            Exception("DB error")
-        )
+        firestore_chain.user_ref.set.side_effect = Exception("DB error")
 
         # Test
         result = credit_service.create_user_with_credits("user123", 50)
@@ -22,14 +22,15 @@ class TestGenerationService:
         """Test successful image generation with Model A"""
         with (
             patch("random.random", return_value=0.95),
-            patch("time.sleep"),
+            patch("time.sleep") as mock_sleep,
         ):  # Skip sleep in tests
             result = generation_service.generate_image(
                 "req123", "Model A", "realistic", "vibrant", "1024x1024", "test prompt"
             )
 
-            assert result.startswith("https://placeholder-model-a.com/image_req123_")
+            assert result == "https://placeholder-model-a.com/image_req123.jpg"
             assert result.endswith(".jpg")
+            mock_sleep.assert_called_once()
 
     def test_generate_image_success_model_b(self, generation_service):
         """Test successful image generation with Model B"""
@@ -38,7 +39,7 @@ class TestGenerationService:
                 "req456", "Model B", "anime", "pastel", "512x512", "test prompt"
             )
 
-            assert result.startswith("https://placeholder-model-b.com/image_req456_")
+            assert result == "https://placeholder-model-b.com/image_req456.jpg"
             assert result.endswith(".jpg")
 
     def test_generate_image_simulated_failure(self, generation_service):
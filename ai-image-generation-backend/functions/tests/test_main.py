@@ -0,0 +1,233 @@
+"""
+tests/test_main.py - Tests for the HTTP handlers
+"""
+
+import orjson
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+from google.api_core.exceptions import FailedPrecondition
+from services.credit_service import CreditService, DeductionStatus
+
+# Importing main initializes Firebase and Cloud Logging; keep both local
+with (
+    patch("firebase_admin.initialize_app"),
+    patch("google.cloud.logging.Client", side_effect=Exception("no credentials")),
+):
+    import main
+
+# Handlers without the CORS wrapper, which needs a Flask request context
+create_generation_request = main.createGenerationRequest.__wrapped__
+get_user_credits = main.getUserCredits.__wrapped__
+
+UPDATE_TIME = datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc)
+
+_PAYLOAD = {
+    "userId": "user123",
+    "model": "Model A",
+    "style": "realistic",
+    "color": "vibrant",
+    "size": "1024x1024",
+    "prompt": "A beautiful sunset",
+}
+
+
+def _response_body(response):
+    return orjson.loads(response.get_data())
+
+
+class TestCreateGenerationRequest:
+    @pytest.fixture
+    def services(self):
+        """Patch the service accessors with mocks; every batch is a new mock"""
+        db = Mock()
+        db.batch.side_effect = lambda: Mock()
+        db.collection.return_value.document.return_value.id = "req123"
+        credit = Mock()
+        credit.get_balance_snapshot.return_value = (50, UPDATE_TIME)
+        report = Mock()
+        generation = Mock()
+        generation.generate_image.return_value = "https://image.jpg"
+
+        with (
+            patch.object(main, "_db", return_value=db),
+            patch.object(main, "_credit", return_value=credit),
+            patch.object(main, "_report", return_value=report),
+            patch.object(main, "_generation", return_value=generation),
+        ):
+            yield Mock(db=db, credit=credit, report=report, generation=generation)
+
+    @staticmethod
+    def _post(payload=_PAYLOAD):
+        return create_generation_request(
+            Mock(method="POST", get_data=Mock(return_value=orjson.dumps(payload)))
+        )
+
+    def test_success_deducts_with_update_time_precondition(self, services):
+        """Test the request, deduction and rollup share one guarded commit"""
+        response = self._post()
+
+        assert response.status_code == 200
+        assert _response_body(response) == {
+            "generationRequestId": "req123",
+            "deductedCredits": 3,
+            "imageUrl": "https://image.jpg",
+        }
+
+        batch = services.credit.build_deduction_batch.call_args.args[0]
+        services.credit.build_deduction_batch.assert_called_once_with(
+            batch, "user123", 3, "req123", UPDATE_TIME
+        )
+        assert services.report.build_request_rollup.call_args.args[0] is batch
+        batch.set.assert_called_once()
+        batch.commit.assert_called_once_with()
+
+        outcome_batch = services.report.build_outcome_rollup.call_args.args[0]
+        assert outcome_batch is not batch
+        assert services.report.build_outcome_rollup.call_args.kwargs == {
+            "completed": True
+        }
+        assert outcome_batch.update.call_args.args[1]["status"] == "completed"
+        outcome_batch.commit.assert_called_once_with()
+
+    @pytest.mark.parametrize(
+        "snapshot, available",
+        [((1, UPDATE_TIME), 1), ((0, None), 0), ((-4, UPDATE_TIME), 0)],
+        ids=["low_balance", "missing_user", "negative_balance"],
+    )
+    def test_insufficient_credits_writes_nothing(self, services, snapshot, available):
+        """Test an unaffordable request returns 402 before any write"""
+        services.credit.get_balance_snapshot.return_value = snapshot
+
+        response = self._post()
+
+        assert response.status_code == 402
+        assert _response_body(response) == {
+            "error": "Insufficient credits",
+            "required": 3,
+            "available": available,
+        }
+        services.db.batch.assert_not_called()
+        services.generation.generate_image.assert_not_called()
+
+    def test_contention_retries_transactionally(self, services):
+        """Test a failed precondition falls back to a transactional deduction"""
+        services.db.batch.side_effect = None
+        services.db.batch.return_value.commit.side_effect = [
+            FailedPrecondition("update time changed"),
+            None,
+        ]
+        services.credit.deduct_credits.return_value = (DeductionStatus.OK, 50)
+        transaction = services.db.transaction.return_value
+
+        with patch.object(main.firestore, "transactional", lambda func: func):
+            response = self._post()
+
+        assert response.status_code == 200
+        services.credit.deduct_credits.assert_called_once_with(
+            transaction, "user123", 3, "req123"
+        )
+        transaction.set.assert_called_once()
+        assert services.report.build_request_rollup.call_args.args[0] is transaction
+
+    def test_contention_insufficient_after_retry(self, services):
+        """Test the transactional retry returns 402 when the balance ran out"""
+        services.db.batch.side_effect = None
+        services.db.batch.return_value.commit.side_effect = FailedPrecondition(
+            "update time changed"
+        )
+        services.credit.deduct_credits.return_value = (DeductionStatus.INSUFFICIENT, 2)
+
+        with patch.object(main.firestore, "transactional", lambda func: func):
+            response = self._post()
+
+        assert response.status_code == 402
+        assert _response_body(response)["available"] == 2
+        services.db.transaction.return_value.set.assert_not_called()
+        services.generation.generate_image.assert_not_called()
+
+    def test_generation_failure_refunds_in_one_commit(self, services):
+        """Test the refund, failed status and rollup land in one batch"""
+        services.generation.generate_image.side_effect = Exception("model down")
+
+        response = self._post()
+
+        assert response.status_code == 500
+        assert _response_body(response)["creditsRefunded"] == 3
+
+        refund_batch = services.credit.build_refund_batch.call_args.args[0]
+        services.credit.build_refund_batch.assert_called_once_with(
+            refund_batch, "user123", 3, "req123"
+        )
+        refund_batch.update.assert_called_once()
+        assert refund_batch.update.call_args.args[1]["status"] == "failed"
+        services.report.build_outcome_rollup.assert_called_once()
+        assert services.report.build_outcome_rollup.call_args.args[0] is refund_batch
+        assert services.report.build_outcome_rollup.call_args.kwargs == {
+            "completed": False
+        }
+        refund_batch.commit.assert_called_once_with()
+
+
+class TestGetUserCredits:
+    @pytest.fixture
+    def credit(self):
+        """Patch the credit service accessor with a mock"""
+        credit = Mock()
+        credit.get_user_credits.return_value = 47
+        with patch.object(main, "_credit", return_value=credit):
+            yield credit
+
+    @staticmethod
+    def _transactions(count):
+        return [
+            {
+                "transactionId": f"trans{i}",
+                "type": "deduction",
+                "credits": 1,
+                "timestamp": datetime(2025, 1, 15, 10, i, tzinfo=timezone.utc),
+            }
+            for i in range(count)
+        ]
+
+    def test_next_cursor_on_full_page(self, credit):
+        """Test a full page returns the cursor of its last transaction"""
+        transactions = self._transactions(50)
+        credit.get_transaction_history.return_value = transactions
+
+        response = get_user_credits(Mock(method="GET", args={"userId": "user123"}))
+
+        body = _response_body(response)
+        assert response.status_code == 200
+        assert body["currentCredits"] == 47
+        assert body["nextCursor"] == CreditService.encode_cursor(transactions[-1])
+
+    def test_no_next_cursor_on_last_page(self, credit):
+        """Test a partial page ends paging"""
+        credit.get_transaction_history.return_value = self._transactions(3)
+
+        response = get_user_credits(Mock(method="GET", args={"userId": "user123"}))
+
+        assert _response_body(response)["nextCursor"] is None
+
+    def test_cursor_is_decoded_for_the_query(self, credit):
+        """Test the cursor is passed to the history query as field values"""
+        credit.get_transaction_history.return_value = []
+        cursor = CreditService.encode_cursor(self._transactions(1)[0])
+
+        get_user_credits(
+            Mock(method="GET", args={"userId": "user123", "cursor": cursor})
+        )
+
+        _, kwargs = credit.get_transaction_history.call_args
+        assert kwargs["start_after"] == CreditService.decode_cursor(cursor)
+
+    def test_invalid_cursor(self, credit):
+        """Test a malformed cursor returns 400 without querying"""
+        response = get_user_credits(
+            Mock(method="GET", args={"userId": "user123", "cursor": "trans2"})
+        )
+
+        assert response.status_code == 400
+        assert _response_body(response) == {"error": "Invalid cursor"}
+        credit.get_transaction_history.assert_not_called()
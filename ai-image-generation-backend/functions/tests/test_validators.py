@@ -5,101 +5,95 @@ tests/test_validators.py - Tests for request validator
 import pytest
 from validators.request_validator import RequestValidator
 
+# A valid request; the tests below patch single fields of it
+_BASE = {
+    "userId": "user123",
+    "model": "Model A",
+    "style": "realistic",
+    "color": "vibrant",
+    "size": "1024x1024",
+    "prompt": "A beautiful sunset",
+}
+# Patch value that removes the field (None is itself a value under test)
+_MISSING = object()
 
-class TestRequestValidator:
-    @pytest.fixture
-    def validator(self):
-        """Create RequestValidator instance"""
-        return RequestValidator()
-
-    def test_validate_generation_request_valid(self, validator):
-        """Test validation with valid request data"""
-        data = {
-            "userId": "user123",
-            "model": "Model A",
-            "style": "realistic",
-            "color": "vibrant",
-            "size": "1024x1024",
-            "prompt": "A beautiful sunset",
-        }
-
-        result = validator.validate_generation_request(data)
-        assert result["valid"] is True
-
-    def test_validate_generation_request_missing_field(self, validator):
-        """Test validation with missing required field"""
-        data = {
-            "userId": "user123",
-            "model": "Model A",
-            "style": "realistic",
-            "color": "vibrant",
-            # Missing size
-            "prompt": "A beautiful sunset",
-        }
 
-        result = validator.validate_generation_request(data)
-        assert result["valid"] is False
-        assert "Missing required field: size" in result["error"]
+@pytest.fixture(scope="class")
+def validator():
+    """Create a RequestValidator instance shared by the class (it is stateless)"""
+    return RequestValidator()
 
-    def test_validate_generation_request_empty_userid(self, validator):
-        """Test validation with empty userId"""
-        data = {
-            "userId": "  ",
-            "model": "Model A",
-            "style": "realistic",
-            "color": "vibrant",
-            "size": "1024x1024",
-            "prompt": "A beautiful sunset",
-        }
-
-        result = validator.validate_generation_request(data)
-        assert result["valid"] is False
-        assert "userId cannot be empty" in result["error"]
 
-    def test_validate_generation_request_invalid_model(self, validator):
-        """Test validation with invalid model"""
-        data = {
-            "userId": "user123",
-            "model": "Model C",
-            "style": "realistic",
-            "color": "vibrant",
-            "size": "1024x1024",
-            "prompt": "A beautiful sunset",
-        }
-
-        result = validator.validate_generation_request(data)
-        assert result["valid"] is False
-        assert "Invalid model" in result["error"]
-
-    def test_validate_generation_request_empty_prompt(self, validator):
-        """Test validation with empty prompt"""
-        data = {
-            "userId": "user123",
-            "model": "Model A",
-            "style": "realistic",
-            "color": "vibrant",
-            "size": "1024x1024",
-            "prompt": "",
-        }
-
-        result = validator.validate_generation_request(data)
-        assert result["valid"] is False
-        assert "Prompt cannot be empty" in result["error"]
-
-    def test_validate_generation_request_long_prompt(self, validator):
-        """Test validation with overly long prompt"""
-        data = {
-            "userId": "user123",
-            "model": "Model A",
-            "style": "realistic",
-            "color": "vibrant",
-            "size": "1024x1024",
-            "prompt": "x" * 1001,  # Over 1000 characters
-        }
+class TestRequestValidator:
+    def test_validate_generation_request_valid(self, validator):
+        """Test validation with valid request data"""
+        result = validator.validate_generation_request(dict(_BASE))
+        assert result.valid is True
+        assert result.error is None
+        assert result.to_dict() == {"valid": True}
+
+        # The success result is shared between calls, so it is read-only
+        with pytest.raises(AttributeError):
+            result.valid = False
+
+    @pytest.mark.parametrize(
+        "patch, err",
+        [
+            ({"size": _MISSING}, "Missing required field: size"),
+            ({"userId": "  "}, "userId cannot be empty"),
+            ({"model": "Model C"}, "Invalid model"),
+            ({"style": ["realistic"]}, "Invalid style"),
+            ({"prompt": ""}, "Prompt cannot be empty"),
+            ({"prompt": "x" * 1001}, "Prompt must be less than 1000 characters"),
+            ({"userId": 123, "prompt": None}, "userId must be a string"),
+            ({"prompt": None}, "Prompt must be a string"),
+        ],
+        ids=[
+            "missing_field",
+            "empty_userid",
+            "invalid_model",
+            "unhashable_option",
+            "empty_prompt",
+            "long_prompt",
+            "non_string_userid",
+            "non_string_prompt",
+        ],
+    )
+    def test_validate_generation_request_invalid(self, validator, patch, err):
+        """Test validation reports the first invalid field"""
+        data = {**_BASE, **patch}
+        for field, value in patch.items():
+            if value is _MISSING:
+                del data[field]
 
         result = validator.validate_generation_request(data)
-        assert result["valid"] is False
-        assert "Prompt must be less than 1000 characters" in result["error"]
+        assert result.valid is False
+        assert err in result.error
+        assert result.to_dict() == {"valid": False, "error": result.error}
+
+    @pytest.mark.parametrize(
+        "changes",
+        [
+            {},
+            {"prompt": " " + "x" * 1000 + " "},
+            {"prompt": "x" * 1001},
+            {"prompt": "   " + "x" * 1000},
+            {"prompt": "x" * 1_000_000},
+            {"prompt": "   "},
+            {"userId": ""},
+            {"userId": 123},
+            {"prompt": None},
+            {"model": "Model C"},
+            {"size": None},
+            {"color": ["vibrant"]},
+        ],
+    )
+    def test_fast_path_matches_full_validation(self, validator, changes):
+        """Test the one-pass check accepts exactly what the full checks accept"""
+        data = {**_BASE, **changes}
+
+        full_result = validator.validate_generation_request(data)
+        assert validator._is_valid_request(data) is full_result.valid
 
     def test_get_credit_cost(self, validator):
         """Test getting credit cost for different sizes"""
@@ -114,6 +108,7 @@ class TestRequestValidator:
         assert validator.validate_user_id("user-123") is True
         assert validator.validate_user_id("user_123") is True
         assert validator.validate_user_id("USER123") is True
+        assert validator.validate_user_id(" " + "x" * 128 + " ") is True
 
     def test_validate_user_id_invalid(self, validator):
         """Test user ID validation with invalid IDs"""
@@ -121,3 +116,7 @@ class TestRequestValidator:
         assert validator.validate_user_id("user@123") is False
         assert validator.validate_user_id("user 123") is False
         assert validator.validate_user_id("x" * 129) is False
+        assert validator.validate_user_id("x" * 1_000_000) is False
+        assert validator.validate_user_id(None) is False
+        assert validator.validate_user_id("usér123") is False
+        assert validator.validate_user_id("user\n123") is False
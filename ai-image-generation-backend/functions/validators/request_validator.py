@@ -2,29 +2,97 @@
 Request Validator - Validates generation request inputs
 """
 
+import string
+from dataclasses import dataclass
+from operator import itemgetter
 from typing import Dict, Any, Optional
 
+# User IDs: ASCII alphanumerics, dash and underscore. Translating with this
+# table deletes those, so anything left over is an invalid character
+_DELETE_USER_ID_CHARS = str.maketrans(
+    "", "", string.ascii_letters + string.digits + "-_"
+)
+
+# Required request fields, in the order they're checked
+_REQUIRED_FIELDS = ("userId", "model", "style", "color", "size", "prompt")
+# Required string fields that must not be blank
+_NONEMPTY_STRING_FIELDS = frozenset({"userId", "prompt"})
+# Fetches every required field in one call; raises KeyError if one is missing
+_request_fields = itemgetter(*_REQUIRED_FIELDS)
+
+
+@dataclass(frozen=True, slots=True)
+class ValidationResult:
+    """Outcome of a validation, with the error message when it failed"""
+
+    valid: bool
+    error: Optional[str] = None
+
+    def to_dict(self):
+        """Convert to dictionary for JSON responses"""
+        if self.error is None:
+            return {"valid": self.valid}
+        return {"valid": self.valid, "error": self.error}
+
+
+# Every result is built once and shared (results are frozen)
+_VALID_OK = ValidationResult(True)
+_ERR_MISSING_FIELD = {
+    field: ValidationResult(False, f"Missing required field: {field}")
+    for field in _REQUIRED_FIELDS
+}
+_ERR_EMPTY_USERID = ValidationResult(False, "userId cannot be empty")
+_ERR_EMPTY_PROMPT = ValidationResult(False, "Prompt cannot be empty")
+_ERR_LONG_PROMPT = ValidationResult(False, "Prompt must be less than 1000 characters")
+_ERR_USERID_TYPE = ValidationResult(False, "userId must be a string")
+_ERR_PROMPT_TYPE = ValidationResult(False, "Prompt must be a string")
+
 
 class RequestValidator:
     """Validator for generation request inputs"""
 
-    # Valid options
-    VALID_MODELS = ["Model A", "Model B"]
-    VALID_STYLES = [
-        "realistic",
-        "anime",
-        "oil painting",
-        "sketch",
-        "cyberpunk",
-        "watercolor",
-    ]
-    VALID_COLORS = ["vibrant", "monochrome", "pastel", "neon", "vintage"]
-    VALID_SIZES = ["512x512", "1024x1024", "1024x1792"]
+    # Valid options (frozensets for constant-time membership checks; values
+    # must be strings first, as lists/dicts from JSON aren't hashable)
+    VALID_MODELS = frozenset({"Model A", "Model B"})
+    VALID_STYLES = frozenset(
+        {
+            "realistic",
+            "anime",
+            "oil painting",
+            "sketch",
+            "cyberpunk",
+            "watercolor",
+        }
+    )
+    VALID_COLORS = frozenset({"vibrant", "monochrome", "pastel", "neon", "vintage"})
+    VALID_SIZES = frozenset({"512x512", "1024x1024", "1024x1792"})
+
+    # Invalid-option errors, built once with the options in a stable order
+    _ERR_INVALID_MODEL = ValidationResult(
+        False, f"Invalid model. Must be one of: {', '.join(sorted(VALID_MODELS))}"
+    )
+    _ERR_INVALID_STYLE = ValidationResult(
+        False, f"Invalid style. Must be one of: {', '.join(sorted(VALID_STYLES))}"
+    )
+    _ERR_INVALID_COLOR = ValidationResult(
+        False, f"Invalid color. Must be one of: {', '.join(sorted(VALID_COLORS))}"
+    )
+    _ERR_INVALID_SIZE = ValidationResult(
+        False, f"Invalid size. Must be one of: {', '.join(sorted(VALID_SIZES))}"
+    )
+
+    # Option fields with their allowed values and error, in check order
+    _ENUM_CHECKS = (
+        ("model", VALID_MODELS, _ERR_INVALID_MODEL),
+        ("style", VALID_STYLES, _ERR_INVALID_STYLE),
+        ("color", VALID_COLORS, _ERR_INVALID_COLOR),
+        ("size", VALID_SIZES, _ERR_INVALID_SIZE),
+    )
 
     # Credit costs by size
     CREDIT_COSTS = {"512x512": 1, "1024x1024": 3, "1024x1792": 4}
 
-    def validate_generation_request(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def validate_generation_request(self, data: Dict[str, Any]) -> ValidationResult:
         """
         Validate generation request data
 
@@ -32,66 +100,81 @@ class RequestValidator:
             data: Request data dictionary
 
         Returns:
-            Dictionary with 'valid' boolean and optional 'error' message
+            Shared ValidationResult with 'valid' and optional 'error' message
         """
+        # Most requests are valid: accept them in one pass and only run the
+        # field-by-field checks below to find the error
+        if self._is_valid_request(data):
+            return _VALID_OK
+
         # Check required fields
-        required_fields = ["userId", "model", "style", "color", "size", "prompt"]
-        for field in required_fields:
+        for field in _REQUIRED_FIELDS:
             if field not in data:
-                return {"valid": False, "error": f"Missing required field: {field}"}
+                return _ERR_MISSING_FIELD[field]
             # Special handling for string fields that shouldn't be empty
-            if field in ["userId", "prompt"] and isinstance(data[field], str):
-                if not data[field].strip():
-                    field_name = "userId" if field == "userId" else field.capitalize()
-                    return {"valid": False, "error": f"{field_name} cannot be empty"}
-
-        # Validate userId
-        user_id = data.get("userId", "").strip()
-        if not user_id:
-            return {"valid": False, "error": "userId cannot be empty"}
-
-        # Validate model
-        model = data.get("model")
-        if model not in self.VALID_MODELS:
-            return {
-                "valid": False,
-                "error": f"Invalid model. Must be one of: {', '.join(self.VALID_MODELS)}",
-            }
-
-        # Validate style
-        style = data.get("style")
-        if style not in self.VALID_STYLES:
-            return {
-                "valid": False,
-                "error": f"Invalid style. Must be one of: {', '.join(self.VALID_STYLES)}",
-            }
-
-        # Validate color
-        color = data.get("color")
-        if color not in self.VALID_COLORS:
-            return {
-                "valid": False,
-                "error": f"Invalid color. Must be one of: {', '.join(self.VALID_COLORS)}",
-            }
-
-        # Validate size
-        size = data.get("size")
-        if size not in self.VALID_SIZES:
-            return {
-                "valid": False,
-                "error": f"Invalid size. Must be one of: {', '.join(self.VALID_SIZES)}",
-            }
-
-        # Validate prompt
-        prompt = data.get("prompt", "").strip()
-        if not prompt:
-            return {"valid": False, "error": "Prompt cannot be empty"}
-
-        if len(prompt) > 1000:
-            return {"valid": False, "error": "Prompt must be less than 1000 characters"}
+            if field in _NONEMPTY_STRING_FIELDS:
+                value = data[field]
+                if not isinstance(value, str):
+                    return _ERR_USERID_TYPE if field == "userId" else _ERR_PROMPT_TYPE
+                # Same as `not value.strip()`, without copying the string
+                if not value or value.isspace():
+                    return _ERR_EMPTY_USERID if field == "userId" else _ERR_EMPTY_PROMPT
+
+        # Validate model, style, color and size
+        for field, allowed, error in self._ENUM_CHECKS:
+            value = data[field]
+            if not isinstance(value, str) or value not in allowed:
+                return error
+
+        # Validate prompt (emptiness was checked with the required fields).
+        # Bound the raw length first, allowing a little surrounding
+        # whitespace, so an oversized prompt is rejected without a copy
+        prompt = data["prompt"]
+        if len(prompt) > 1000 + 2:
+            return _ERR_LONG_PROMPT
+
+        if len(prompt.strip()) > 1000:
+            return _ERR_LONG_PROMPT
 
         # All validations passed
-        return {"valid": True}
+        return _VALID_OK
+
+    def _is_valid_request(self, data: Dict[str, Any]) -> bool:
+        """
+        Check a generation request without building an error
+
+        Accepts exactly the requests validate_generation_request accepts.
+
+        Args:
+            data: Request data dictionary
+
+        Returns:
+            True if valid, False if the full checks must report an error
+        """
+        try:
+            user_id, model, style, color, size, prompt = _request_fields(data)
+        except KeyError:
+            return False
+
+        if not (
+            isinstance(user_id, str)
+            and isinstance(model, str)
+            and isinstance(style, str)
+            and isinstance(color, str)
+            and isinstance(size, str)
+            and isinstance(prompt, str)
+        ):
+            return False
+
+        return (
+            model in self.VALID_MODELS
+            and style in self.VALID_STYLES
+            and color in self.VALID_COLORS
+            and size in self.VALID_SIZES
+            and bool(user_id.strip())
+            and len(prompt) <= 1000 + 2
+            and 0 < len(prompt.strip()) <= 1000
+        )
 
     def get_credit_cost(self, size: str) -> Optional[int]:
         """
@@ -115,7 +198,13 @@ class RequestValidator:
         Returns:
             True if valid, False otherwise
         """
-        if not user_id or not isinstance(user_id, str):
+        if not isinstance(user_id, str):
+            return False
+
+        # Reject empty and oversized IDs before stripping or scanning them,
+        # allowing a little surrounding whitespace
+        n = len(user_id)
+        if n == 0 or n > 128 + 2:
             return False
 
         # Remove whitespace
@@ -126,9 +215,7 @@ class RequestValidator:
             return False
 
         # Check for valid characters (alphanumeric, dash, underscore)
-        import re
-
-        if not re.match(r"^[a-zA-Z0-9_-]+$", user_id):
+        if user_id.translate(_DELETE_USER_ID_CHARS):
             return False
 
         return True